@@ -1,15 +1,28 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, PyMongoError
 from bson import ObjectId
+import io
 import uuid
-import qrcode
-from io import BytesIO
-import base64
 import os
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timezone
 import json
+import logging
+import time
 from pdf_qr_generator import PDFQRGenerator
+from qr_renderer import QRRenderEngine, IMAGE_MIMETYPES, build_qr_url, build_qr_image_url, render_qr_image
+from qr_signing import qr_signer
+from code_filter import CodeFilter
+from generation_jobs import GenerationJobRunner
+from db_indexes import ENSURE_INDEXES, INITIALIZED_FILTER, IndexManager
+from gate_mode import GATE_MODE, GateScanner
+from scan_events import ScanEventLog, scan_event
+from scan_stream import ScanFeed
+from qr_stats import StatsCounters, compute_stats
+from guest_import import GuestImportError, detect_format, parse_guest_row, read_guest_rows
+from zip_export import export_query, iter_invitation_entries, iter_qr_image_entries, iter_zip
 
 app = Flask(__name__)
 CORS(app, origins=[
@@ -23,162 +36,683 @@ MONGO_URI = os.environ.get('MONGO_URI', 'mongodb+srv://sidiqolasode_db_user:sEAD
 client = MongoClient(MONGO_URI)
 db = client['wedding_verification']
 qr_codes_collection = db['qr_codes']
+scan_events_collection = db['scan_events']
+stats_collection = db['stats']
+
+# Bulk generation settings
+GENERATION_BATCH_SIZE = int(os.environ.get('GENERATION_BATCH_SIZE', 500))
+GENERATION_MAX_RETRIES = int(os.environ.get('GENERATION_MAX_RETRIES', 3))
+DUPLICATE_KEY_ERROR = 11000
+
+# Largest batch accepted by /api/scan/batch, and rounds to settle concurrent scans
+SCAN_BATCH_MAX = int(os.environ.get('SCAN_BATCH_MAX', 1000))
+SCAN_BATCH_RETRIES = 3
+
+# Guest list rows written per bulk_write by /api/init/bulk and import-guests
+INIT_BULK_BATCH = int(os.environ.get('INIT_BULK_BATCH', 1000))
+
+# Browser/CDN lifetime of on-demand QR images (with signing, only for URLs
+# naming the active key)
+QR_IMAGE_MAX_AGE = int(os.environ.get('QR_IMAGE_MAX_AGE', 31536000))
+
+# Response field carrying the inline image for each image format
+INLINE_IMAGE_FIELDS = {
+    'png': 'qr_image_base64',
+    'svg': 'qr_image_svg'
+}
+
+# Answer for a code rejected in-process (bad signature or not in the code
+# filter); the same as an unknown code, so a forger learns nothing either way
+UNKNOWN_SCAN_RESULT = {"status": "invalid", "reason": "QR code not found"}
+
+logger = logging.getLogger(__name__)
 
 class QRCodeManager:
     def __init__(self):
         self.base_url = os.environ.get('BASE_URL', 'https://doublehaffairs.vercel.app')
+        self.render_engine = QRRenderEngine()
     
-    def generate_bulk_qr_codes(self, count=200, generate_pdfs=False):
-        """Generate bulk QR codes with unique IDs"""
-        codes = []
-        
-        for i in range(1, count + 1):
-            code_id = str(uuid.uuid4())
-            
-            # Create QR code document
-            qr_doc = {
-                "code_id": code_id,
-                "qr_number": i,
-                "name": None,
-                "scan_count": 0,
-                "max_scans": 2,
-                "created_at": datetime.utcnow(),
-                "initialized_at": None
-            }
-            
-            # Insert into MongoDB
-            result = qr_codes_collection.insert_one(qr_doc)
-            
-            # Generate QR code image
-            qr_url = f"{self.base_url}/init?code={code_id}"
-            qr = qrcode.QRCode(version=1, box_size=10, border=5)
-            qr.add_data(qr_url)
-            qr.make(fit=True)
-            
-            # Convert to base64 for easy storage/transmission
-            img = qr.make_image(fill_color="black", back_color="white")
-            buffer = BytesIO()
-            img.save(buffer, format='PNG')
-            img_base64 = base64.b64encode(buffer.getvalue()).decode()
-            
-            code_data = {
-                "code_id": code_id,
-                "qr_number": i,
-                "qr_url": qr_url,
-                "qr_image_base64": img_base64,
-                "_id": str(result.inserted_id)
-            }
-            
-            # Generate PDF version if requested
+    def generate_bulk_qr_codes(self, count=200, generate_pdfs=False, **options):
+        """Generate bulk QR codes with unique IDs and return them as a list"""
+        return list(self.iter_bulk_qr_codes(count, generate_pdfs, **options))
+
+    def iter_bulk_qr_codes(self, count=200, generate_pdfs=False, batch_size=None, progress_callback=None,
+                           start_number=1, job_id=None, include_images=True, image_format='png', pdf_qr_mode=None):
+        """
+        Generate bulk QR codes with unique IDs, yielding each one once it is stored
+
+        Documents are built and written in chunks of ``batch_size`` with a single
+        ``insert_many`` per chunk. PDF status is stored on the document before it
+        is inserted, so a chunk costs one round trip with or without PDFs.
+        QR images for the next chunk render on ``self.render_engine`` while the
+        current chunk is written. ``progress_callback`` receives the timing
+        report of every chunk.
+
+        Only the current and next chunk are held in memory, so memory use
+        depends on ``batch_size`` rather than ``count``. Codes are numbered from
+        ``start_number``; ``job_id`` tags every document with the background
+        generation job that created it.
+
+        With ``include_images=False`` no image is rendered; clients fetch it
+        from ``qr_image_url`` when they need it. ``image_format`` selects inline
+        base64 PNGs (``qr_image_base64``) or SVG markup (``qr_image_svg``), and
+        ``pdf_qr_mode`` whether PDF invitations get a vector or raster QR.
+        """
+        batch_size = max(1, int(batch_size or GENERATION_BATCH_SIZE))
+        end_number = start_number + count
+        chunk_starts = list(range(start_number, end_number, batch_size))
+
+        def start_chunk(start):
+            # Pick the chunk's code IDs and hand its images to the render engine,
+            # which works on them while the previous chunk is being written
+            numbers = range(start, min(start + batch_size, end_number))
+            code_ids = [str(uuid.uuid4()) for _ in numbers]
+            qr_urls = [build_qr_url(self.base_url, code_id) for code_id in code_ids]
+            rendering = self.render_engine.submit(qr_urls, image_format) if include_images else None
+            return numbers, code_ids, qr_urls, rendering
+
+        next_chunk = start_chunk(chunk_starts[0]) if chunk_starts else None
+
+        for chunk_number, start in enumerate(chunk_starts, start=1):
+            chunk_started = time.perf_counter()
+            numbers, code_ids, qr_urls, rendering = next_chunk
+            if chunk_number < len(chunk_starts):
+                next_chunk = start_chunk(chunk_starts[chunk_number])
+            images = rendering.result() if rendering else [None] * len(code_ids)
+            docs = []
+            chunk_codes = []
+
+            # Generate PDF versions if requested, the whole chunk at once on the
+            # PDF worker pool
+            pdf_results = {}
             if generate_pdfs:
-                pdf_result = pdf_qr_generator.embed_qr_in_pdf(code_id, i)
-                if pdf_result.get('success'):
-                    # Update MongoDB document with PDF info
-                    qr_codes_collection.update_one(
-                        {"code_id": code_id},
-                        {
-                            "$set": {
-                                "pdf_filename": pdf_result.get('filename'),
-                                "pdf_path": pdf_result.get('file_path'),
-                                "has_pdf": True,
-                                "pdf_generated_at": datetime.utcnow()
-                            }
-                        }
-                    )
-                    code_data.update({
-                        "pdf_filename": pdf_result.get('filename'),
-                        "pdf_path": pdf_result.get('file_path'),
-                        "has_pdf": True
-                    })
-                else:
-                    # Update MongoDB document with PDF error
-                    qr_codes_collection.update_one(
-                        {"code_id": code_id},
-                        {
-                            "$set": {
-                                "has_pdf": False,
-                                "pdf_error": pdf_result.get('error'),
-                                "pdf_generated_at": datetime.utcnow()
-                            }
-                        }
+                for pdf_result in pdf_qr_generator.iter_bulk_pdf_qr_codes(
+                    [{"code_id": code_id, "qr_number": i} for i, code_id in zip(numbers, code_ids)],
+                    qr_mode=pdf_qr_mode
+                ):
+                    pdf_results[pdf_result["code_id"]] = pdf_result
+
+            for i, code_id, qr_url, image in zip(numbers, code_ids, qr_urls, images):
+                # Create QR code document; the _id is assigned client-side so a
+                # retried insert can recognise documents an earlier attempt wrote
+                qr_doc = {
+                    "_id": ObjectId(),
+                    "code_id": code_id,
+                    "qr_number": i,
+                    "name": None,
+                    "scan_count": 0,
+                    "max_scans": 2,
+                    "created_at": datetime.utcnow(),
+                    "initialized_at": None
+                }
+                if job_id:
+                    qr_doc["job_id"] = job_id
+
+                code_data = {
+                    "code_id": code_id,
+                    "qr_number": i,
+                    "qr_url": qr_url,
+                    "qr_image_url": build_qr_image_url(code_id, image_format),
+                    "_id": str(qr_doc["_id"])
+                }
+                if include_images:
+                    code_data[INLINE_IMAGE_FIELDS[image_format]] = image
+
+                # The PDF outcome is stored with the document itself instead of
+                # a follow-up update_one
+                if generate_pdfs:
+                    pdf_fields = pdf_status_fields(pdf_results[code_id])
+                    qr_doc.update(pdf_fields)
+                    code_data.update(
+                        (key, pdf_fields[key]) for key in ("pdf_filename", "pdf_path", "has_pdf", "pdf_error")
+                        if pdf_fields.get(key) is not None
                     )
-                    code_data.update({
-                        "has_pdf": False,
-                        "pdf_error": pdf_result.get('error')
+
+                docs.append(qr_doc)
+                chunk_codes.append(code_data)
+
+            rendered = time.perf_counter()
+            attempts = self._insert_chunk(docs)
+            stats_counters.add_codes(docs)
+            code_filter.add_many(doc["code_id"] for doc in docs)
+            written = time.perf_counter()
+
+            report = {
+                "chunk": chunk_number,
+                "first_qr_number": start,
+                "size": len(docs),
+                "attempts": attempts,
+                "render_seconds": round(rendered - chunk_started, 4),
+                "write_seconds": round(written - rendered, 4),
+                "total_seconds": round(written - chunk_started, 4)
+            }
+            logger.info(
+                "Chunk %(chunk)d: %(size)d codes from #%(first_qr_number)d, "
+                "render %(render_seconds).3fs, write %(write_seconds).3fs (%(attempts)d attempt(s))",
+                report
+            )
+            if progress_callback:
+                progress_callback(report)
+
+            yield from chunk_codes
+
+    def iter_refresh_pdfs(self, query=None, qr_mode=None, force=False, workers=None, batch_size=None):
+        """
+        Regenerate only the PDF invitations that are missing or stale
+
+        Every code's expected render key (see PDFQRGenerator.render_key) is
+        compared with the one stored on its document. Codes whose key matches
+        and whose file is still on disk at the recorded size are skipped, the
+        rest go to the PDF worker pool. New keys are written back with one
+        bulk_write per ``batch_size`` results, so a run that stops halfway
+        resumes after the last recorded batch. A template or settings change
+        only changes the keys of the invitations it affects.
+
+        Yields:
+            dict: The code's PDF record with ``status`` 'skipped', 'generated'
+            or 'failed'
+        """
+        batch_size = max(1, int(batch_size or GENERATION_BATCH_SIZE))
+        skipped = deque()
+
+        def stale_codes():
+            cursor = qr_codes_collection.find(
+                query or {},
+                {"_id": 0, "code_id": 1, "qr_number": 1, "pdf_render_key": 1, "pdf_path": 1, "pdf_size_bytes": 1}
+            ).sort("qr_number", 1)
+            for doc in cursor:
+                if not force and self._pdf_is_current(doc, pdf_qr_generator.render_key(doc["code_id"], qr_mode)):
+                    skipped.append({
+                        "code_id": doc["code_id"],
+                        "qr_number": doc.get("qr_number"),
+                        "file_path": doc["pdf_path"],
+                        "status": "skipped"
                     })
-            
-            codes.append(code_data)
-        
-        return codes
-    
+                    continue
+                yield doc
+
+        updates = []
+        for record in pdf_qr_generator.iter_bulk_pdf_qr_codes(stale_codes(), workers=workers, qr_mode=qr_mode):
+            while skipped:
+                yield skipped.popleft()
+            updates.append(UpdateOne({"code_id": record["code_id"]}, {"$set": pdf_status_fields(record)}))
+            if len(updates) >= batch_size:
+                qr_codes_collection.bulk_write(updates, ordered=False)
+                updates = []
+            yield dict(record, status="generated" if record["success"] else "failed")
+
+        if updates:
+            qr_codes_collection.bulk_write(updates, ordered=False)
+        while skipped:
+            yield skipped.popleft()
+
+    def _pdf_is_current(self, doc, render_key):
+        """Whether a code's stored PDF was rendered with ``render_key`` and is intact on disk"""
+        if doc.get("pdf_render_key") != render_key or not doc.get("pdf_path"):
+            return False
+        try:
+            return os.path.getsize(doc["pdf_path"]) == doc.get("pdf_size_bytes")
+        except OSError:
+            return False
+
+    def _insert_chunk(self, docs):
+        """
+        Insert a chunk of QR code documents with one unordered insert_many
+
+        Failed inserts are retried up to GENERATION_MAX_RETRIES times. Because every
+        document carries its own _id, a duplicate key error on retry means that
+        document was already written, so retries never create duplicates.
+
+        Returns:
+            int: Number of attempts used
+        """
+        pending = docs
+        for attempt in range(1, GENERATION_MAX_RETRIES + 1):
+            try:
+                qr_codes_collection.insert_many(pending, ordered=False)
+                return attempt
+            except BulkWriteError as e:
+                errors = [
+                    error for error in e.details.get('writeErrors', [])
+                    if error.get('code') != DUPLICATE_KEY_ERROR
+                ]
+                if not errors and not e.details.get('writeConcernErrors'):
+                    return attempt
+                if errors:
+                    failed = {error['index'] for error in errors}
+                    pending = [doc for index, doc in enumerate(pending) if index in failed]
+                if attempt == GENERATION_MAX_RETRIES:
+                    raise
+            except ConnectionFailure:
+                # The outcome of the whole request is unknown, resend every
+                # pending document and let duplicate keys mark the written ones
+                if attempt == GENERATION_MAX_RETRIES:
+                    raise
+            time.sleep(0.5 * attempt)
+        return GENERATION_MAX_RETRIES
+
     def get_qr_code(self, code_id):
         """Get QR code document by code_id"""
         return qr_codes_collection.find_one({"code_id": code_id})
     
     def initialize_qr_code(self, code_id, name):
-        """Initialize QR code with guest name"""
-        qr_doc = self.get_qr_code(code_id)
-        
-        if not qr_doc:
-            return {"error": "Invalid QR code"}
-        
-        if qr_doc.get("name"):
-            return {"error": "QR code already initialized"}
-        
-        # Update with name and initialization timestamp
-        result = qr_codes_collection.update_one(
-            {"code_id": code_id},
+        """
+        Initialize QR code with guest name
+
+        One conditional find_one_and_update that only matches a code without a
+        name, so when two guests open the same link at once exactly one of them
+        wins. Only a rejected initialization reads the document to explain why.
+        """
+        qr_doc = qr_codes_collection.find_one_and_update(
+            {"code_id": code_id, "name": {"$in": [None, ""]}},
             {
                 "$set": {
                     "name": name.strip(),
                     "initialized_at": datetime.utcnow()
                 }
-            }
+            },
+            projection={"_id": 0, "qr_number": 1, "scan_count": 1, "max_scans": 1},
+            return_document=ReturnDocument.AFTER
         )
         
-        if result.modified_count > 0:
-            return {"success": True, "message": "QR initialized successfully", "name": name}
-        else:
-            return {"error": "Failed to initialize QR code"}
+        if not qr_doc:
+            return self._init_rejection(code_id)
+        
+        max_scans = qr_doc.get("max_scans", 2)
+        stats_counters.add_initialized([(max_scans, max_scans, qr_doc.get("scan_count", 0))])
+        
+        return {
+            "success": True,
+            "message": "QR initialized successfully",
+            "name": name,
+            "qr_number": qr_doc.get("qr_number"),
+            "max_scans": max_scans
+        }
     
-    def scan_qr_code(self, code_id):
-        """Process QR code scan at event"""
-        qr_doc = self.get_qr_code(code_id)
+    def initialize_bulk(self, rows, dry_run=False, batch_size=None):
+        """
+        Pre-assign guest names to codes from a guest list
+
+        Rows are handled in chunks of ``batch_size``: each chunk reads every
+        referenced code with one query, validates the rows against it, then
+        writes all valid rows with a single bulk_write. As in
+        initialize_qr_code, each update only matches a code without a name;
+        the updates are tagged with a batch marker so one more query tells
+        which rows were applied. A code listed twice is only assigned once.
+
+        Args:
+            rows: Iterable of raw rows (dicts with code_id or qr_number, name
+                and optional max_scans), e.g. from guest_import.read_guest_rows
+            dry_run: Validate every row without writing anything
+
+        Returns:
+            dict: Counts per status, timing, and one result per row
+        """
+        started = time.perf_counter()
+        batch_size = batch_size or INIT_BULK_BATCH
+        results = []
+        seen = set()
+        chunk = []
+        for number, raw in enumerate(rows, start=1):
+            chunk.append((number, raw))
+            if len(chunk) == batch_size:
+                results.extend(self._initialize_chunk(chunk, seen, dry_run))
+                chunk = []
+        if chunk:
+            results.extend(self._initialize_chunk(chunk, seen, dry_run))
         
-        if not qr_doc:
-            return {"status": "invalid", "reason": "QR code not found"}
+        elapsed = time.perf_counter() - started
+        counts = {}
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        return {
+            "success": True,
+            "dry_run": dry_run,
+            "total": len(results),
+            "counts": counts,
+            "seconds": round(elapsed, 3),
+            "rows_per_second": round(len(results) / elapsed, 1) if elapsed else None,
+            "results": results
+        }
+    
+    def _initialize_chunk(self, chunk, seen, dry_run):
+        parsed = [(number,) + parse_guest_row(raw) for number, raw in chunk]
+        code_ids = [row["code_id"] for _, row, error in parsed if not error and row["code_id"]]
+        qr_numbers = [row["qr_number"] for _, row, error in parsed if not error and not row["code_id"]]
+        by_code_id = {}
+        by_qr_number = {}
+        if code_ids or qr_numbers:
+            for doc in qr_codes_collection.find(
+                {"$or": [{"code_id": {"$in": code_ids}}, {"qr_number": {"$in": qr_numbers}}]},
+                {"_id": 0, "code_id": 1, "qr_number": 1, "name": 1, "scan_count": 1, "max_scans": 1}
+            ):
+                by_code_id[doc["code_id"]] = doc
+                by_qr_number.setdefault(doc.get("qr_number"), []).append(doc)
         
-        if not qr_doc.get("name"):
-            return {"status": "invalid", "reason": "QR code not initialized"}
+        results = []
+        ready = []
+        for number, row, error in parsed:
+            result = {"row": number, "code_id": row.get("code_id"), "qr_number": row.get("qr_number"), "name": row.get("name")}
+            doc = None
+            if not error:
+                if row["code_id"]:
+                    matches = [by_code_id[row["code_id"]]] if row["code_id"] in by_code_id else []
+                else:
+                    # Separate generation runs can number their codes from 1 again
+                    matches = by_qr_number.get(row["qr_number"], [])
+                doc = matches[0] if len(matches) == 1 else None
+                if len(matches) > 1:
+                    error = "Ambiguous qr_number, use code_id"
+                elif not doc:
+                    error = "Invalid QR code"
+                elif row["qr_number"] is not None and doc.get("qr_number") != row["qr_number"]:
+                    error = "code_id and qr_number belong to different codes"
+                elif doc["code_id"] in seen:
+                    error = "Code listed more than once"
+                elif doc.get("name"):
+                    error = "QR code already initialized"
+            if error:
+                result.update(status="rejected", error=error)
+            else:
+                seen.add(doc["code_id"])
+                result.update(
+                    code_id=doc["code_id"],
+                    qr_number=doc.get("qr_number"),
+                    max_scans=row["max_scans"] or doc.get("max_scans", 2)
+                )
+                result["status"] = "valid" if dry_run else "initialized"
+                ready.append(result)
+            results.append(result)
+        
+        if dry_run or not ready:
+            return results
         
-        if qr_doc.get("scan_count", 0) >= qr_doc.get("max_scans", 2):
-            return {
-                "status": "invalid", 
-                "reason": f"Maximum scans ({qr_doc.get('max_scans', 2)}) already used"
+        batch_id = ObjectId()
+        initialized_at = datetime.utcnow()
+        updates = []
+        for result in ready:
+            fields = {
+                "name": result["name"],
+                "max_scans": result["max_scans"],
+                "initialized_at": initialized_at,
+                "init_batch": batch_id
             }
+            updates.append(UpdateOne({"code_id": result["code_id"], "name": {"$in": [None, ""]}}, {"$set": fields}))
+        qr_codes_collection.bulk_write(updates, ordered=False)
         
-        # Increment scan count
-        new_scan_count = qr_doc.get("scan_count", 0) + 1
-        qr_codes_collection.update_one(
-            {"code_id": code_id},
+        # Codes initialized by someone else since the read were not updated
+        applied = {
+            doc["code_id"]
+            for doc in qr_codes_collection.find(
+                {"code_id": {"$in": [result["code_id"] for result in ready]}, "init_batch": batch_id},
+                {"_id": 0, "code_id": 1}
+            )
+        }
+        changes = []
+        for result in ready:
+            if result["code_id"] not in applied:
+                result.update(status="rejected", error="QR code already initialized")
+                continue
+            doc = by_code_id[result["code_id"]]
+            changes.append((doc.get("max_scans", 2), result["max_scans"], doc.get("scan_count", 0)))
+        stats_counters.add_initialized(changes)
+        return results
+    
+    def _init_rejection(self, code_id):
+        """Explain why an initialization did not match the conditional update"""
+        if not qr_codes_collection.find_one({"code_id": code_id}, {"_id": 1}):
+            return {"error": "Invalid QR code"}
+        
+        return {"error": "QR code already initialized"}
+    
+    def scan_qr_code(self, code_id, device_id=None):
+        """
+        Process QR code scan at event
+
+        The checks and the increment are one conditional find_one_and_update,
+        so a valid scan is a single round trip and two gates scanning the same
+        ticket at once can never both pass the max_scans check. Only a rejected
+        scan reads the document again to explain why. Every scan, rejected
+        ones included, is recorded in scan_events; the ticket only keeps its
+        counter.
+        """
+        scanned_at = datetime.utcnow()
+        qr_doc = qr_codes_collection.find_one_and_update(
             {
-                "$set": {"scan_count": new_scan_count},
-                "$push": {"scan_history": datetime.utcnow()}
-            }
+                "code_id": code_id,
+                "name": {"$nin": [None, ""]},
+                "$expr": {"$lt": [{"$ifNull": ["$scan_count", 0]}, {"$ifNull": ["$max_scans", 2]}]}
+            },
+            {"$inc": {"scan_count": 1}},
+            projection={"_id": 0, "name": 1, "qr_number": 1, "scan_count": 1, "max_scans": 1},
+            return_document=ReturnDocument.AFTER
         )
         
-        scans_left = qr_doc.get("max_scans", 2) - new_scan_count
+        if not qr_doc:
+            result = self._scan_rejection(code_id)
+        else:
+            result = {
+                "status": "valid",
+                "name": qr_doc.get("name"),
+                "scans_left": qr_doc.get("max_scans", 2) - qr_doc["scan_count"],
+                "qr_number": qr_doc.get("qr_number")
+            }
+            stats_counters.add_scans([(qr_doc.get("max_scans", 2), qr_doc["scan_count"] - 1, qr_doc["scan_count"])])
         
+        scan_event_log.record(scan_event(code_id, result, scanned_at, device_id))
+        return result
+    
+    def scan_qr_codes_batch(self, records):
+        """
+        Apply an ordered batch of queued scans, e.g. replayed by an offline scanner
+
+        Every ticket in the batch is read once, the records are checked against
+        max_scans in their given order, and the accepted scans are written with a
+        single bulk_write: one ``$inc`` per ticket. Each update only matches if
+        the ticket's scan_count is still the one read, so a scan at another gate
+        in between cannot push a ticket past max_scans; those tickets are
+        re-read and their records decided again (up to SCAN_BATCH_RETRIES
+        times, then rejected with "scan again"). Every record is logged to scan_events with its original
+        timestamp.
+
+        Args:
+            records: List of dicts with code_id, scanned_at (datetime) and device_id
+
+        Returns:
+            list: One result per record, in order, shaped like scan_qr_code's
+        """
+        results = [None] * len(records)
+        remaining = list(range(len(records)))
+        
+        for attempt in range(1, SCAN_BATCH_RETRIES + 1):
+            code_ids = list({records[index]["code_id"] for index in remaining})
+            tickets = {
+                doc["code_id"]: doc
+                for doc in qr_codes_collection.find(
+                    {"code_id": {"$in": code_ids}},
+                    {"_id": 0, "code_id": 1, "name": 1, "qr_number": 1, "scan_count": 1, "max_scans": 1}
+                )
+            }
+            
+            # Decide every record in order against the counts just read
+            accepted = {}
+            for index in remaining:
+                code_id = records[index]["code_id"]
+                ticket = tickets.get(code_id)
+                if not ticket:
+                    results[index] = {"status": "invalid", "reason": "QR code not found"}
+                elif not ticket.get("name"):
+                    results[index] = {"status": "invalid", "reason": "QR code not initialized"}
+                else:
+                    max_scans = ticket.get("max_scans", 2)
+                    scan_count = ticket.get("scan_count", 0) + len(accepted.get(code_id, []))
+                    if scan_count >= max_scans:
+                        results[index] = {
+                            "status": "invalid",
+                            "reason": f"Maximum scans ({max_scans}) already used"
+                        }
+                    else:
+                        accepted.setdefault(code_id, []).append(index)
+                        results[index] = {
+                            "status": "valid",
+                            "name": ticket.get("name"),
+                            "scans_left": max_scans - scan_count - 1,
+                            "qr_number": ticket.get("qr_number")
+                        }
+            
+            if not accepted:
+                remaining = []
+                break
+            
+            batch_id = ObjectId()
+            qr_codes_collection.bulk_write([
+                UpdateOne(
+                    {"code_id": code_id, "scan_count": tickets[code_id].get("scan_count", 0)},
+                    {
+                        "$inc": {"scan_count": len(indexes)},
+                        "$set": {"last_scan_batch": batch_id}
+                    }
+                )
+                for code_id, indexes in accepted.items()
+            ], ordered=False)
+            
+            # Tickets whose count changed after the read were not updated;
+            # decide their records again, or reject them after the last round
+            applied = {
+                doc["code_id"]
+                for doc in qr_codes_collection.find(
+                    {"code_id": {"$in": list(accepted)}, "last_scan_batch": batch_id},
+                    {"_id": 0, "code_id": 1}
+                )
+            }
+            stats_counters.add_scans([
+                (tickets[code_id].get("max_scans", 2), tickets[code_id].get("scan_count", 0),
+                 tickets[code_id].get("scan_count", 0) + len(accepted[code_id]))
+                for code_id in applied
+            ])
+            remaining = [
+                index for index in remaining
+                if records[index]["code_id"] in accepted and records[index]["code_id"] not in applied
+            ]
+            if not remaining:
+                break
+        
+        for index in remaining:
+            results[index] = {"status": "invalid", "reason": "Ticket changed during the batch, scan again"}
+        
+        scan_event_log.queue([
+            scan_event(record["code_id"], result, record["scanned_at"], record.get("device_id"), source="batch")
+            for record, result in zip(records, results)
+        ])
+        
+        return [
+            dict(result, code_id=record["code_id"], device_id=record.get("device_id"), scanned_at=record["scanned_at"])
+            for record, result in zip(records, results)
+        ]
+    
+    def _scan_rejection(self, code_id):
+        """Explain why a scan did not match the conditional update"""
+        qr_doc = qr_codes_collection.find_one({"code_id": code_id}, {"_id": 0, "name": 1, "max_scans": 1})
+        
+        if not qr_doc:
+            return {"status": "invalid", "reason": "QR code not found"}
+        
+        if not qr_doc.get("name"):
+            return {"status": "invalid", "reason": "QR code not initialized"}
+        
+        return {
+            "status": "invalid", 
+            "reason": f"Maximum scans ({qr_doc.get('max_scans', 2)}) already used"
+        }
+
+def pdf_status_fields(pdf_result):
+    """Document fields recording the outcome of one PDF invitation"""
+    if pdf_result.get('success'):
         return {
-            "status": "valid",
-            "name": qr_doc.get("name"),
-            "scans_left": scans_left,
-            "qr_number": qr_doc.get("qr_number")
+            "pdf_filename": pdf_result.get('filename'),
+            "pdf_path": pdf_result.get('file_path'),
+            "pdf_size_bytes": pdf_result.get('size_bytes'),
+            "pdf_render_key": pdf_result.get('render_key'),
+            "has_pdf": True,
+            "pdf_error": None,
+            "pdf_generated_at": datetime.utcnow()
         }
+    return {
+        "has_pdf": False,
+        "pdf_render_key": None,
+        "pdf_error": pdf_result.get('error'),
+        "pdf_generated_at": datetime.utcnow()
+    }
 
 # Initialize QR manager and PDF QR generator
 qr_manager = QRCodeManager()
 pdf_qr_generator = PDFQRGenerator(base_url=os.environ.get('BASE_URL', 'https://doublehaffairs.vercel.app'))
+scan_feed = ScanFeed(db, qr_codes_collection)
+scan_event_log = ScanEventLog(scan_events_collection, on_record=scan_feed.publish_scans)
+stats_counters = StatsCounters(stats_collection, qr_codes_collection)
+job_runner = GenerationJobRunner(db['generation_jobs'], qr_codes_collection, qr_manager)
+index_manager = IndexManager(db)
+gate_scanner = GateScanner(qr_codes_collection, scan_event_log, counters=stats_counters) if GATE_MODE else None
+code_filter = CodeFilter(qr_codes_collection)
+GENERATION_JOBS_ENABLED = os.environ.get('GENERATION_JOBS_ENABLED', 'true').lower() == 'true'
+
+@app.before_request
+def start_job_runner():
+    """Start the generation job worker once this process serves requests"""
+    # Started here rather than at import so CLI tools importing app never claim
+    # jobs; it also resumes jobs left behind by a previous worker
+    if GENERATION_JOBS_ENABLED:
+        job_runner.start()
+    if gate_scanner and not gate_scanner.ready:
+        try:
+            gate_scanner.start()
+        except Exception:
+            # Logged by the gate. Scans are refused (gate_unavailable) rather
+            # than decided by MongoDB next to another worker's table; a later
+            # request retries, e.g. once the previous worker frees the journal
+            pass
+    code_filter.start()
+    scan_feed.start()
+
+# Indexes are created in the background so startup never waits on MongoDB;
+# not in worker processes that re-run this module as their main module
+if ENSURE_INDEXES and __name__ != '__mp_main__':
+    index_manager.ensure_in_background()
+
+def gate_unavailable():
+    """Error response for scans while gate mode is on but not running in this worker, else None"""
+    if gate_scanner and not gate_scanner.ready:
+        return jsonify({
+            "error": "Gate is not running in this worker",
+            "reason": gate_scanner.start_error
+        }), 503
+    return None
+
+def in_process_rejection(code_id, sig=None):
+    """
+    Why a code fails the in-process checks, None when it passes
+
+    Returns:
+        str: 'bad_signature' or 'unknown_code' (not in the code filter)
+    """
+    if not qr_signer.accepts(code_id, sig):
+        return 'bad_signature'
+    if not code_filter.may_contain(code_id):
+        return 'unknown_code'
+    return None
+
+def is_known_code(code_id, sig=None):
+    """Whether a code passes the in-process checks: its signature, then the code filter"""
+    return in_process_rejection(code_id, sig) is None
+
+def unknown_scan_event(code_id, rejection, scanned_at=None, device_id=None, source="api"):
+    """
+    Scan event of a code rejected in-process
+
+    The client gets UNKNOWN_SCAN_RESULT either way; the event keeps the
+    in-process reason so forged codes stand out in scan_events and the feed.
+    """
+    return scan_event(code_id, {"status": "invalid", "reason": rejection}, scanned_at, device_id, source)
 
 # API Routes
 @app.route('/api/generate', methods=['POST'])
@@ -186,12 +720,123 @@ def generate_qr_codes():
     """Generate bulk QR codes"""
     data = request.get_json() or {}
     count = data.get('count', 200)
+    batch_size = data.get('batch_size')
+    include_images = data.get('include_images', True)
+    image_format = data.get('image_format', 'png')
+    
+    if image_format not in INLINE_IMAGE_FIELDS:
+        return jsonify({"error": "image_format must be 'png' or 'svg'"}), 400
+    
+    if data.get('async'):
+        try:
+            count = int(count)
+        except (TypeError, ValueError):
+            return jsonify({"error": "count must be an integer"}), 400
+        if count < 1:
+            return jsonify({"error": "count must be at least 1"}), 400
+        
+        job = job_runner.enqueue(count, generate_pdfs=bool(data.get('generate_pdfs')), batch_size=batch_size)
+        return jsonify({
+            "success": True,
+            "message": f"Queued generation of {count} QR codes",
+            "job_id": job["_id"],
+            "status_url": f"/api/jobs/{job['_id']}",
+            "codes_url": f"/api/jobs/{job['_id']}/codes"
+        }), 202
+    
+    if data.get('stream') or request.args.get('stream'):
+        return Response(
+            stream_with_context(stream_generated_codes(count, batch_size, include_images, image_format)),
+            mimetype='application/x-ndjson'
+        )
     
     try:
-        codes = qr_manager.generate_bulk_qr_codes(count)
+        batches = []
+        codes = qr_manager.generate_bulk_qr_codes(
+            count,
+            batch_size=batch_size,
+            progress_callback=batches.append,
+            include_images=include_images,
+            image_format=image_format
+        )
         return jsonify({
             "success": True,
             "message": f"Generated {len(codes)} QR codes",
+            "codes": codes,
+            "batches": batches
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def stream_generated_codes(count, batch_size=None, include_images=True, image_format='png'):
+    """Yield generated codes as NDJSON lines, ending with a summary line"""
+    generated = 0
+    batches = []
+    try:
+        for code in qr_manager.iter_bulk_qr_codes(
+            count,
+            batch_size=batch_size,
+            progress_callback=batches.append,
+            include_images=include_images,
+            image_format=image_format
+        ):
+            generated += 1
+            yield json.dumps(code) + "\n"
+        yield json.dumps({
+            "success": True,
+            "message": f"Generated {generated} QR codes",
+            "generated": generated,
+            "batches": batches
+        }) + "\n"
+    except Exception as e:
+        # Headers are already sent, so the failure is reported in-band
+        yield json.dumps({"error": str(e), "generated": generated}) + "\n"
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_generation_job(job_id):
+    """Get progress of a background generation job"""
+    try:
+        job = job_runner.get_job(job_id)
+        
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        
+        return jsonify({
+            "success": True,
+            "job": job_runner.get_progress(job)
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs/<job_id>/codes', methods=['GET'])
+def get_generation_job_codes(job_id):
+    """Get the codes written by a background generation job, page by page"""
+    try:
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = min(max(1, request.args.get('per_page', 100, type=int)), 500)
+        
+        image_format = request.args.get('image_format', 'png')
+        if image_format not in INLINE_IMAGE_FIELDS:
+            return jsonify({"error": "image_format must be 'png' or 'svg'"}), 400
+        
+        job = job_runner.get_job(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        
+        codes = job_runner.get_codes_page(job_id, page, per_page)
+        for code in codes:
+            code["qr_url"] = build_qr_url(qr_manager.base_url, code["code_id"])
+            code["qr_image_url"] = build_qr_image_url(code["code_id"], image_format)
+        if request.args.get('include_images', 'true').lower() == 'true':
+            images = qr_manager.render_engine.render_batch([code["qr_url"] for code in codes], image_format)
+            for code, image in zip(codes, images):
+                code[INLINE_IMAGE_FIELDS[image_format]] = image
+        
+        return jsonify({
+            "success": True,
+            "job": job_runner.get_progress(job),
+            "page": page,
+            "per_page": per_page,
             "codes": codes
         })
     except Exception as e:
@@ -234,11 +879,48 @@ def initialize_qr():
     if not name.strip():
         return jsonify({"error": "Name cannot be empty"}), 400
     
+    # Checked in-process, before any database access
+    if not is_known_code(code_id, data.get('sig')):
+        return jsonify({"error": "Invalid QR code"}), 400
+    
     result = qr_manager.initialize_qr_code(code_id, name)
     
     if "error" in result:
         return jsonify(result), 400
     
+    if gate_scanner:
+        gate_scanner.add_ticket(code_id, name.strip(), result.get("qr_number"), max_scans=result["max_scans"])
+    scan_feed.publish_init(code_id, name.strip(), result.get("qr_number"))
+    
+    return jsonify(result)
+
+@app.route('/api/init/bulk', methods=['POST'])
+def initialize_bulk():
+    """Pre-assign guest names to codes from a CSV or JSON guest list"""
+    dry_run = request.args.get('dry_run', 'false').lower() == 'true'
+    fmt = detect_format(content_type=request.content_type)
+    
+    try:
+        if fmt == 'json':
+            source = request.get_json(silent=True)
+            if isinstance(source, dict):
+                dry_run = dry_run or bool(source.get('dry_run'))
+        else:
+            # Read row by row straight from the request body
+            source = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+        
+        result = qr_manager.initialize_bulk(read_guest_rows(source, fmt), dry_run=dry_run)
+    except (GuestImportError, UnicodeDecodeError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    for row in result["results"]:
+        if row["status"] == "initialized":
+            if gate_scanner:
+                gate_scanner.add_ticket(row["code_id"], row["name"], row["qr_number"], max_scans=row["max_scans"])
+            scan_feed.publish_init(row["code_id"], row["name"], row["qr_number"])
+    
     return jsonify(result)
 
 @app.route('/api/scan', methods=['POST'])
@@ -249,16 +931,135 @@ def scan_qr():
     if not data or not data.get('code_id'):
         return jsonify({"error": "Missing code_id"}), 400
     
+    unavailable = gate_unavailable()
+    if unavailable:
+        return unavailable
+    
     code_id = data.get('code_id')
-    result = qr_manager.scan_qr_code(code_id)
+    device_id = data.get('device_id')
+    rejection = in_process_rejection(code_id, data.get('sig'))
+    if rejection:
+        # Rejected in-process, before any ticket lookup
+        result = dict(UNKNOWN_SCAN_RESULT)
+        scan_event_log.record(unknown_scan_event(code_id, rejection, device_id=device_id))
+    elif gate_scanner:
+        # Answered from the in-memory table, synced to MongoDB in the background
+        result = gate_scanner.scan(code_id, device_id=device_id)
+    else:
+        result = qr_manager.scan_qr_code(code_id, device_id)
     
     return jsonify(result)
 
+@app.route('/api/scan/batch', methods=['POST'])
+def scan_qr_batch():
+    """Apply an ordered batch of queued scans from an offline scanner"""
+    data = request.get_json()
+    records = data.get('scans') if isinstance(data, dict) else data
+    
+    if not isinstance(records, list) or not records:
+        return jsonify({"error": "Missing scans"}), 400
+    
+    if len(records) > SCAN_BATCH_MAX:
+        return jsonify({"error": f"At most {SCAN_BATCH_MAX} scans per batch"}), 400
+    
+    unavailable = gate_unavailable()
+    if unavailable:
+        return unavailable
+    
+    scans = []
+    rejections = []
+    for index, record in enumerate(records):
+        if not isinstance(record, dict) or not record.get('code_id'):
+            return jsonify({"error": f"Scan {index}: missing code_id"}), 400
+        try:
+            scanned_at = parse_timestamp(record.get('scanned_at'))
+        except ValueError:
+            return jsonify({"error": f"Scan {index}: invalid scanned_at"}), 400
+        scans.append({
+            "code_id": record['code_id'],
+            "scanned_at": scanned_at,
+            "device_id": record.get('device_id')
+        })
+        rejections.append(in_process_rejection(record['code_id'], record.get('sig')))
+    
+    try:
+        # Forged and unknown codes are answered here; only the rest reach the database
+        accepted = [scan for scan, rejection in zip(scans, rejections) if not rejection]
+        scan_event_log.queue([
+            unknown_scan_event(scan["code_id"], rejection, scan["scanned_at"], scan["device_id"], source="batch")
+            for scan, rejection in zip(scans, rejections) if rejection
+        ])
+        if gate_scanner:
+            applied = [
+                dict(gate_scanner.scan(scan["code_id"], scan["scanned_at"], scan["device_id"]), **scan)
+                for scan in accepted
+            ]
+        else:
+            applied = qr_manager.scan_qr_codes_batch(accepted) if accepted else []
+        
+        applied = iter(applied)
+        results = [
+            dict(UNKNOWN_SCAN_RESULT, **scan) if rejection else next(applied)
+            for scan, rejection in zip(scans, rejections)
+        ]
+        
+        return jsonify({
+            "success": True,
+            "total": len(results),
+            "valid": sum(1 for result in results if result["status"] == "valid"),
+            "results": results
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 timestamp to naive UTC, now when missing"""
+    if not value:
+        return datetime.utcnow()
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+@app.route('/api/stream/scans', methods=['GET'])
+def stream_scans():
+    """Push scans and initializations to the dashboard as Server-Sent Events"""
+    # EventSource sends Last-Event-ID itself on reconnect; the query parameter
+    # lets a reloaded page resume from an id it stored
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    
+    response = Response(
+        stream_with_context(scan_feed.iter_sse(last_event_id)),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/code-filter', methods=['GET'])
+def get_code_filter_status():
+    """Get this worker's code filter: codes, memory footprint and false positive rate"""
+    return jsonify({
+        "success": True,
+        "filter": code_filter.status()
+    })
+
+@app.route('/api/gate/status', methods=['GET'])
+def get_gate_status():
+    """Get the state of this gate: tickets loaded, scans waiting to sync, conflicts"""
+    if not gate_scanner:
+        return jsonify({"error": "Gate mode is not enabled"}), 404
+    
+    return jsonify({
+        "success": True,
+        "gate": gate_scanner.status()
+    })
+
 @app.route('/api/code/<code_id>', methods=['GET'])
 def get_code_info(code_id):
     """Get specific QR code information"""
     try:
-        qr_doc = qr_manager.get_qr_code(code_id)
+        qr_doc = qr_manager.get_qr_code(code_id) if code_filter.may_contain(code_id) else None
         
         if not qr_doc:
             return jsonify({"error": "QR code not found"}), 404
@@ -273,24 +1074,106 @@ def get_code_info(code_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/code/<code_id>/scans', methods=['GET'])
+def get_code_scans(code_id):
+    """Get the scan events of a QR code, rejected scans included, newest first"""
+    try:
+        limit = min(max(1, request.args.get('limit', 100, type=int)), 1000)
+        events = scan_event_log.history(code_id, limit)
+        
+        return jsonify({
+            "success": True,
+            "code_id": code_id,
+            "scans": events,
+            "total": len(events)
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/code/<code_id>/qr.<image_format>', methods=['GET'])
+def get_code_image(code_id, image_format):
+    """
+    Render a QR code image on demand with HTTP caching
+
+    Signed images are only cached for QR_IMAGE_MAX_AGE under a URL naming
+    the active key (``?k=<key id>``, as in ``qr_image_url``); other requests
+    revalidate every time, so a key rotation is picked up at once.
+    """
+    if image_format not in IMAGE_MIMETYPES:
+        return jsonify({"error": "Unsupported image format"}), 404
+    
+    try:
+        if not code_filter.may_contain(code_id) or not qr_codes_collection.find_one({"code_id": code_id}, {"_id": 1}):
+            return jsonify({"error": "QR code not found"}), 404
+        
+        data, etag = render_qr_image(build_qr_url(qr_manager.base_url, code_id), image_format)
+        
+        response = Response(data, mimetype=IMAGE_MIMETYPES[image_format])
+        if qr_signer.enabled:
+            etag = f"{qr_signer.active_key_id}-{etag}"
+        response.set_etag(etag)
+        if not qr_signer.enabled or request.args.get('k') == qr_signer.active_key_id:
+            response.headers['Cache-Control'] = f"public, max-age={QR_IMAGE_MAX_AGE}"
+        else:
+            response.headers['Cache-Control'] = "no-cache"
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def get_export_query():
+    """Build the export filter from the qr_from, qr_to and initialized query parameters"""
+    return export_query(
+        qr_from=request.args.get('qr_from', type=int),
+        qr_to=request.args.get('qr_to', type=int),
+        initialized_only=request.args.get('initialized', 'false').lower() == 'true'
+    )
+
+def zip_response(entries, filename):
+    """Stream a ZIP archive with chunked transfer, never holding it in memory"""
+    response = Response(stream_with_context(iter_zip(entries)), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # Keep reverse proxies from buffering the whole archive
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/export/qr.zip', methods=['GET'])
+def export_qr_images():
+    """Download QR images as a streamed ZIP archive"""
+    image_format = request.args.get('format', 'png')
+    if image_format not in IMAGE_MIMETYPES:
+        return jsonify({"error": "format must be 'png' or 'svg'"}), 400
+    
+    try:
+        cursor = qr_codes_collection.find(get_export_query(), {"_id": 0, "code_id": 1, "qr_number": 1}).sort("qr_number", 1)
+        entries = iter_qr_image_entries(cursor, qr_manager.render_engine, qr_manager.base_url, image_format)
+        return zip_response(entries, "qr_codes.zip")
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/export/invitations.zip', methods=['GET'])
+def export_invitations():
+    """Download invitation PDFs as a streamed ZIP archive"""
+    try:
+        cursor = qr_codes_collection.find(
+            get_export_query(),
+            {"_id": 0, "code_id": 1, "qr_number": 1, "pdf_filename": 1}
+        ).sort("qr_number", 1)
+        entries = iter_invitation_entries(
+            cursor,
+            pdf_qr_generator,
+            render_missing=request.args.get('render_missing', 'true').lower() == 'true'
+        )
+        return zip_response(entries, "invitations.zip")
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get system statistics"""
     try:
-        total_codes = qr_codes_collection.count_documents({})
-        initialized_codes = qr_codes_collection.count_documents({"name": {"$ne": None}})
-        used_codes = qr_codes_collection.count_documents({"scan_count": {"$gt": 0}})
-        max_used_codes = qr_codes_collection.count_documents({"scan_count": {"$gte": 2}})
-        
         return jsonify({
             "success": True,
-            "stats": {
-                "total_codes": total_codes,
-                "initialized_codes": initialized_codes,
-                "used_codes": used_codes,
-                "max_used_codes": max_used_codes,
-                "unused_codes": total_codes - used_codes
-            }
+            "stats": compute_stats(qr_codes_collection, scan_events_collection, stats_counters)
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -301,7 +1184,7 @@ def get_attendees():
     try:
         # Get all QR codes that have been initialized with names
         attendees = list(qr_codes_collection.find(
-            {"name": {"$ne": None}},  # Only codes with names
+            INITIALIZED_FILTER,  # Only codes with names
             {
                 "_id": 0,
                 "name": 1,
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark: ms per invitation, re-parsing the template vs the cached template
+
+"before" replays the previous embed_qr_in_pdf: open and parse the template for
+every code, draw a reportlab overlay with a resized PNG, merge it into page 2.
+"after" is PDFQRGenerator.embed_qr_in_pdf with the per-process template cache.
+
+Usage:
+    python benchmarks/bench_pdf_template.py --count 500 [--template "DoubleHaffairs .pdf"]
+
+Without a template a synthetic three-page one is generated.
+"""
+
+import os
+import io
+import sys
+import time
+import uuid
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_ROOT)
+
+import qrcode
+from PIL import Image
+from PyPDF2 import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
+from pdf_qr_generator import PDFQRGenerator
+
+TEMPLATE_NAME = "DoubleHaffairs .pdf"
+
+def make_synthetic_template(path):
+    """Write a three-page A5 template with text, fonts and vector artwork"""
+    c = canvas.Canvas(str(path), pagesize=(420, 595))
+    for page in range(3):
+        c.setFont("Helvetica-Bold", 28)
+        c.drawString(60, 520, f"Double H Affairs - page {page + 1}")
+        c.setFont("Times-Italic", 13)
+        for line in range(32):
+            c.drawString(40, 480 - line * 13, "You are cordially invited to celebrate with us")
+        for ring in range(40):
+            c.circle(210, 90, 10 + ring, stroke=1, fill=0)
+        c.showPage()
+    c.save()
+
+def legacy_embed(base_url, template_path, code_id, qr_number):
+    """The previous embed_qr_in_pdf, kept here as the baseline"""
+    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
+    qr.add_data(f"{base_url}/init?code={code_id}")
+    qr.make(fit=True)
+    qr_img = qr.make_image(fill_color="black", back_color="white").resize((120, 120), Image.Resampling.LANCZOS)
+
+    with open(template_path, 'rb') as pdf_file:
+        pdf_reader = PdfReader(pdf_file)
+        pdf_writer = PdfWriter()
+        pdf_writer.add_page(pdf_reader.pages[0])
+
+        second_page = pdf_reader.pages[1]
+        page_width = float(second_page.mediabox.width)
+        page_height = float(second_page.mediabox.height)
+
+        overlay_buffer = io.BytesIO()
+        c = canvas.Canvas(overlay_buffer, pagesize=(page_width, page_height))
+        qr_buffer = io.BytesIO()
+        qr_img.save(qr_buffer, format='PNG')
+        qr_buffer.seek(0)
+        x_pos = (page_width - 120) / 2
+        y_pos = (page_height - 120) / 2 - 67
+        c.drawImage(ImageReader(qr_buffer), x_pos, y_pos, width=120, height=120)
+        c.save()
+        overlay_buffer.seek(0)
+
+        second_page.merge_page(PdfReader(overlay_buffer).pages[0])
+        pdf_writer.add_page(second_page)
+        for i in range(2, len(pdf_reader.pages)):
+            pdf_writer.add_page(pdf_reader.pages[i])
+
+        output_path = Path("qr_pdfs") / f"invitation_qr_{qr_number}_{code_id[:8]}.pdf"
+        output_path.parent.mkdir(exist_ok=True)
+        with open(output_path, 'wb') as output_file:
+            pdf_writer.write(output_file)
+        with open(output_path, 'rb') as pdf_file:
+            pdf_file.read()
+    return output_path
+
+def run(label, embed, code_ids):
+    started = time.perf_counter()
+    for number, code_id in enumerate(code_ids, start=1):
+        embed(code_id, number)
+    elapsed = time.perf_counter() - started
+    size = sum(f.stat().st_size for f in Path("qr_pdfs").iterdir()) / len(code_ids)
+    shutil.rmtree("qr_pdfs")
+    ms = elapsed * 1000 / len(code_ids)
+    print(f"{label:<28} {ms:>9.2f} ms/invitation {size / 1024:>9.1f} KB/invitation {elapsed:>8.1f}s total")
+    return ms
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark invitation PDF generation per invitation")
+    parser.add_argument('--count', type=int, default=500, help='Invitations per variant (default: 500)')
+    parser.add_argument('--template', help=f'Template PDF (default: "{TEMPLATE_NAME}" or a synthetic one)')
+    args = parser.parse_args()
+
+    template = Path(args.template or os.path.join(REPO_ROOT, TEMPLATE_NAME)).resolve()
+    code_ids = [str(uuid.uuid4()) for _ in range(args.count)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        if template.exists():
+            shutil.copy(template, TEMPLATE_NAME)
+        else:
+            print("Template not found, using a synthetic one")
+            make_synthetic_template(TEMPLATE_NAME)
+
+        generator = PDFQRGenerator()
+        print(f"{args.count} invitations per variant\n")
+        before = run("before (parse per invite)", lambda c, n: legacy_embed(generator.base_url, TEMPLATE_NAME, c, n), code_ids)
+        for mode in ('raster', 'vector'):
+            after = run(f"after ({mode})", lambda c, n: generator.embed_qr_in_pdf(c, n, qr_mode=mode), code_ids)
+            print(f"{'':<28} {before / after:>9.2f}x faster")
+
+if __name__ == "__main__":
+    main()
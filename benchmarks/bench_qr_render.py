@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: per-code QR rendering cost, PIL drawing vs NumPy rasterizer
+
+Compares the previous rendering paths (draw at box_size=10 through PIL, plus
+the LANCZOS resize the PDF generator used) with qr_renderer.render_qr_png,
+which scales the module matrix straight to the target size.
+
+Usage:
+    python benchmarks/bench_qr_render.py --codes 500
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import qrcode
+from PIL import Image
+import numpy as np
+from qr_renderer import QR_IMAGE_SIZE, build_qr_url, make_qr, pixels_to_image, rasterize, render_qr_png
+
+BASE_URL = "https://doublehaffairs.vercel.app"
+
+def legacy_api_png(qr_url):
+    """Previous QRCodeManager path: box_size=10 PIL drawing"""
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(qr_url)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def legacy_pdf_png(qr_url, size=120):
+    """Previous PDFQRGenerator path: box_size=10 drawing, LANCZOS resize, PNG"""
+    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
+    qr.add_data(qr_url)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    img = img.resize((size, size), Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def legacy_raster(qr):
+    """Rasterize an encoded QR the previous way: PIL drawing, LANCZOS, PNG"""
+    img = qr.make_image(fill_color="black", back_color="white")
+    img = img.resize((120, 120), Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def numpy_raster(qr):
+    """Rasterize an encoded QR through the NumPy path at 120px"""
+    img = pixels_to_image(rasterize(np.array(qr.get_matrix(), dtype=bool), 120))
+    buffer = BytesIO()
+    img.save(buffer, format='PNG', bits=1)
+    return buffer.getvalue()
+
+def time_per_code(render, items):
+    started = time.perf_counter()
+    total_bytes = sum(len(render(item)) for item in items)
+    elapsed = time.perf_counter() - started
+    return elapsed * 1000 / len(items), total_bytes / len(items)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark QR rendering per code")
+    parser.add_argument('--codes', type=int, default=500, help='Codes to render per variant (default: 500)')
+    args = parser.parse_args()
+
+    qr_urls = [build_qr_url(BASE_URL, str(uuid.uuid4())) for _ in range(args.codes)]
+
+    variants = [
+        ("legacy API (PIL, box_size=10)", legacy_api_png),
+        ("legacy PDF (PIL + LANCZOS 120px)", legacy_pdf_png),
+        (f"numpy rasterizer ({QR_IMAGE_SIZE}px)", render_qr_png),
+        ("numpy rasterizer (120px)", lambda qr_url: render_qr_png(qr_url, size_px=120)),
+    ]
+
+    # Warm up imports and encoders
+    for _, render in variants:
+        render(qr_urls[0])
+
+    results = {}
+    print(f"Rendering {args.codes} codes per variant\n")
+    print(f"{'variant':<36} {'ms/code':>9} {'bytes/code':>11}")
+    for label, render in variants:
+        ms, size = time_per_code(render, qr_urls)
+        results[label] = ms
+        print(f"{label:<36} {ms:>9.3f} {size:>11.0f}")
+
+    baseline = results["legacy API (PIL, box_size=10)"]
+    print()
+    for label, ms in results.items():
+        print(f"{label:<36} {baseline / ms:>6.2f}x vs legacy API")
+
+    # Encoding (mask selection) is shared by both paths; time the raster stage alone
+    qrs = [make_qr(qr_url) for qr_url in qr_urls]
+    legacy_ms, _ = time_per_code(legacy_raster, qrs)
+    numpy_ms, _ = time_per_code(numpy_raster, qrs)
+    print("\nRaster stage only (120px, encoding excluded):")
+    print(f"{'PIL draw + LANCZOS + PNG':<36} {legacy_ms:>9.3f} ms/code")
+    print(f"{'NumPy upscale + 1-bit PNG':<36} {numpy_ms:>9.3f} ms/code ({legacy_ms / numpy_ms:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Code ID Filter for Wedding Guest Verification System
+
+Each worker keeps a Bloom filter of every code_id in ``qr_codes``, so scan,
+init and code lookups can answer "not found" for unknown IDs without a
+MongoDB query. A Bloom filter has no false negatives for the codes it holds:
+"absent" is final once the filter is current, "present" still goes to the
+database, and a false positive only costs the query that would have run
+anyway.
+
+The filter is built from an ``_id``/``code_id`` projection when the worker
+starts serving, and codes generated by this worker are added as they are
+written. Codes written elsewhere (other workers, generation jobs, CLI
+tools) are picked up by a refresh that reads documents newer than the last
+one. A miss triggers that refresh at most every CODE_FILTER_REFRESH_SECONDS;
+a miss in between goes to MongoDB, so the throttle only limits refresh cost
+and a code that exists is never rejected.
+"""
+
+import os
+import math
+import time
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+import pymongo
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+# Keep a filter of code IDs to reject unknown codes without a query
+CODE_FILTER_ENABLED = os.environ.get('CODE_FILTER_ENABLED', 'true').lower() == 'true'
+
+# Target false positive rate at the filter's capacity
+CODE_FILTER_FP_RATE = float(os.environ.get('CODE_FILTER_FP_RATE', 0.001))
+
+# Minimum number of codes a filter is sized for; it is rebuilt twice as large
+# once the codes outgrow it
+CODE_FILTER_MIN_CAPACITY = int(os.environ.get('CODE_FILTER_MIN_CAPACITY', 10000))
+
+# Least time between refreshes triggered by misses
+CODE_FILTER_REFRESH_SECONDS = float(os.environ.get('CODE_FILTER_REFRESH_SECONDS', 5))
+
+# Seconds a refresh may hold up the lookup that triggered it
+CODE_FILTER_REFRESH_TIMEOUT = float(os.environ.get('CODE_FILTER_REFRESH_TIMEOUT', 0.5))
+
+# ObjectIds are created by clients whose clocks differ a little; a refresh
+# re-reads this far back so a code with a slightly older _id is not missed
+REFRESH_OVERLAP = timedelta(minutes=1)
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, using double hashing of one blake2b digest"""
+
+    def __init__(self, capacity, fp_rate=CODE_FILTER_FP_RATE):
+        self.capacity = max(1, capacity)
+        self.fp_rate = fp_rate
+        self.size_bits = max(64, math.ceil(-self.capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size_bits / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size_bits for i in range(self.hash_count)]
+
+    def add(self, value):
+        """Add a value; returns False when it was (probably) there already"""
+        added = False
+        for position in self._positions(value):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def expected_fp_rate(self):
+        """False positive rate at the current number of values"""
+        return (1 - math.exp(-self.hash_count * self.count / self.size_bits)) ** self.hash_count
+
+class CodeFilter:
+    """Bloom filter of the code IDs in a collection, kept current for one worker"""
+
+    def __init__(self, codes_collection, enabled=None):
+        self.codes_collection = codes_collection
+        self.enabled = CODE_FILTER_ENABLED if enabled is None else enabled
+        self._bloom = None
+        self._watermark = None
+        self._last_refresh = 0.0
+        self._lock = threading.Lock()
+        self._started = False
+        self._building = False
+        self.lookups = 0
+        self.rejected = 0
+        # Misses passed on to MongoDB because no refresh was due
+        self.deferred = 0
+        self.refreshes = 0
+        self.built_at = None
+        self.build_seconds = None
+
+    @property
+    def ready(self):
+        return self._bloom is not None
+
+    def start(self):
+        """Build the filter on a daemon thread, once per process"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._build_in_background()
+
+    def build(self):
+        """
+        Read every code_id and swap in a new filter sized for them
+
+        Lookups keep using the previous filter (or the database, before the
+        first build) until the new one is complete.
+        """
+        started = time.perf_counter()
+        watermark = ObjectId()
+        capacity = max(CODE_FILTER_MIN_CAPACITY, 2 * self.codes_collection.estimated_document_count())
+        bloom = BloomFilter(capacity)
+        for doc in self.codes_collection.find({}, {"_id": 0, "code_id": 1}):
+            if doc.get("code_id"):
+                bloom.add(doc["code_id"])
+
+        with self._lock:
+            self._bloom = bloom
+            self._watermark = watermark
+            self._last_refresh = time.monotonic()
+        self.built_at = watermark.generation_time
+        self.build_seconds = time.perf_counter() - started
+        logger.info("Code filter built: %d codes, %d KB in %.2fs", bloom.count, len(bloom.bits) // 1024, self.build_seconds)
+        # Codes written between the count and the cursor may already need more room
+        self._grow_if_full()
+
+    def add_many(self, code_ids):
+        """Add codes written by this worker"""
+        bloom = self._bloom
+        if bloom is None:
+            return
+        with self._lock:
+            for code_id in code_ids:
+                bloom.add(code_id)
+        self._grow_if_full()
+
+    def may_contain(self, code_id):
+        """
+        Whether a code can exist; False means it certainly does not
+
+        A miss is only final right after a refresh has read the codes added
+        elsewhere; when no refresh is due (at most one per
+        CODE_FILTER_REFRESH_SECONDS) or it fails, the code may exist and the
+        caller asks MongoDB. Before the filter is built every code may exist.
+        """
+        bloom = self._bloom
+        if bloom is None or not isinstance(code_id, str):
+            return True
+        self.lookups += 1
+        if code_id in bloom:
+            return True
+        if not self._try_refresh():
+            self.deferred += 1
+            return True
+        if code_id in self._bloom:
+            return True
+        self.rejected += 1
+        return False
+
+    def refresh(self):
+        """Add codes inserted since the last refresh, by any worker"""
+        watermark = ObjectId()
+        since = ObjectId.from_datetime(self._watermark.generation_time - REFRESH_OVERLAP)
+        code_ids = [
+            doc["code_id"]
+            for doc in self.codes_collection.find({"_id": {"$gte": since}}, {"_id": 0, "code_id": 1})
+            if doc.get("code_id")
+        ]
+        with self._lock:
+            for code_id in code_ids:
+                self._bloom.add(code_id)
+            self._watermark = watermark
+        self.refreshes += 1
+        self._grow_if_full()
+        return len(code_ids)
+
+    def status(self):
+        """Size, fill and hit figures of the filter"""
+        bloom = self._bloom
+        if bloom is None:
+            return {"enabled": self.enabled, "ready": False}
+        return {
+            "enabled": self.enabled,
+            "ready": True,
+            "codes": bloom.count,
+            "capacity": bloom.capacity,
+            "size_bytes": len(bloom.bits),
+            "hash_functions": bloom.hash_count,
+            "target_fp_rate": bloom.fp_rate,
+            "expected_fp_rate": bloom.expected_fp_rate(),
+            "lookups": self.lookups,
+            "rejected": self.rejected,
+            "deferred": self.deferred,
+            "refreshes": self.refreshes,
+            "built_at": self.built_at.isoformat() if self.built_at else None,
+            "build_seconds": round(self.build_seconds, 3) if self.build_seconds is not None else None
+        }
+
+    def _try_refresh(self):
+        """Refresh if one is due; True when the filter is current as of now"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_refresh < CODE_FILTER_REFRESH_SECONDS:
+                return False
+            self._last_refresh = now
+        try:
+            # Runs on the request thread: give up quickly when MongoDB is unreachable
+            with pymongo.timeout(CODE_FILTER_REFRESH_TIMEOUT):
+                self.refresh()
+            return True
+        except Exception as e:
+            logger.warning("Code filter refresh failed: %s", e)
+            return False
+
+    def _grow_if_full(self):
+        bloom = self._bloom
+        if bloom is not None and bloom.count > bloom.capacity and not self._building:
+            self._build_in_background()
+
+    def _build_in_background(self):
+        self._building = True
+        threading.Thread(target=self._build, name="code-filter", daemon=True).start()
+
+    def _build(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception("Code filter build failed")
+        finally:
+            self._building = False
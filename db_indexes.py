@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+MongoDB Index Management for Wedding Guest Verification System
+
+This module declares the indexes every query of the app relies on and creates
+them idempotently at startup. It can also explain the hot queries and warn
+when one of them still falls back to a collection scan (COLLSCAN).
+"""
+
+import os
+import logging
+import threading
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Create indexes when the app starts (set to false where a DBA manages them)
+ENSURE_INDEXES = os.environ.get('ENSURE_INDEXES', 'true').lower() == 'true'
+
+# Filter matching codes that have been initialized with a guest name; queries
+# must use it as-is for the partial index below to apply
+INITIALIZED_FILTER = {"name": {"$type": "string"}}
+
+# Required indexes per collection
+INDEXES = {
+    "qr_codes": [
+        # Every scan, init and image request looks a code up by code_id
+        IndexModel([("code_id", ASCENDING)], name="code_id_unique", unique=True),
+        # Listings, exports and the next qr_number sort on it
+        IndexModel([("qr_number", ASCENDING)], name="qr_number"),
+        # Initialized guests only; uninitialized codes stay out of the index
+        IndexModel([("name", ASCENDING)], name="initialized_name", partialFilterExpression=INITIALIZED_FILTER),
+        # Attendee list order
+        IndexModel([("initialized_at", ASCENDING)], name="initialized_at"),
+        # Codes of a background generation job, in order
+        IndexModel(
+            [("job_id", ASCENDING), ("qr_number", ASCENDING)],
+            name="job_id_qr_number",
+            partialFilterExpression={"job_id": {"$exists": True}}
+        )
+    ],
+    "scan_events": [
+        # Time-bucketed: one ticket's history, arrivals per hour by result,
+        # and plain time order for ranges and tailing
+        IndexModel([("code_id", ASCENDING), ("ts", ASCENDING)], name="code_id_ts"),
+        IndexModel([("bucket", ASCENDING), ("result", ASCENDING)], name="bucket_result"),
+        IndexModel([("ts", ASCENDING)], name="ts")
+    ],
+    "generation_jobs": [
+        # Claiming the oldest queued or abandoned job
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at")
+    ]
+}
+
+# Hot queries checked for collection scans: (collection, filter, sort, description)
+CHECKED_QUERIES = [
+    ("qr_codes", {"code_id": ""}, None, "code lookup (scan, init, /api/code)"),
+    ("qr_codes", {}, [("qr_number", ASCENDING)], "/api/codes listing"),
+    ("qr_codes", INITIALIZED_FILTER, [("initialized_at", ASCENDING)], "/api/attendees"),
+    ("qr_codes", {"job_id": ""}, [("qr_number", ASCENDING)], "generation job codes"),
+    ("scan_events", {"code_id": ""}, [("ts", ASCENDING)], "ticket scan history"),
+    ("generation_jobs", {"status": {"$in": ["queued", "running"]}}, [("created_at", ASCENDING)], "job claim")
+]
+
+class IndexManager:
+    """Creates the declared indexes and reports on query plans"""
+
+    def __init__(self, db, indexes=None, checked_queries=None):
+        self.db = db
+        self.indexes = indexes if indexes is not None else INDEXES
+        self.checked_queries = checked_queries if checked_queries is not None else CHECKED_QUERIES
+        self._started = False
+        self._lock = threading.Lock()
+
+    def ensure(self):
+        """
+        Create every declared index that does not exist yet
+
+        create_indexes is a no-op for indexes that already exist with the same
+        definition. A failure (for example existing duplicate code_ids blocking
+        the unique index) is logged and reported, and never stops the others.
+
+        Returns:
+            list: One dict per index with collection, name and status
+                ('ok' or 'failed') plus an error message on failure
+        """
+        report = []
+        for collection_name, models in self.indexes.items():
+            collection = self.db[collection_name]
+            for model in models:
+                name = model.document["name"]
+                try:
+                    collection.create_indexes([model])
+                    report.append({"collection": collection_name, "name": name, "status": "ok"})
+                except OperationFailure as e:
+                    logger.warning("Could not create index %s on %s: %s", name, collection_name, e)
+                    report.append({"collection": collection_name, "name": name, "status": "failed", "error": str(e)})
+        return report
+
+    def check_query_plans(self):
+        """
+        Explain the hot queries and warn about any that scan the collection
+
+        Returns:
+            list: One dict per query with description, collection, winning
+                plan stages and whether it is a COLLSCAN
+        """
+        results = []
+        for collection_name, query, sort, description in self.checked_queries:
+            command = {"find": collection_name, "filter": query}
+            if sort:
+                command["sort"] = dict(sort)
+            try:
+                explained = self.db.command({"explain": command, "verbosity": "queryPlanner"})
+                plan = explained.get("queryPlanner", {}).get("winningPlan", {})
+            except (PyMongoError, NotImplementedError) as e:
+                results.append({"query": description, "collection": collection_name, "error": str(e)})
+                continue
+
+            stages = plan_stages(plan)
+            collscan = "COLLSCAN" in stages
+            if collscan:
+                logger.warning("Query '%s' on %s uses a collection scan (%s)", description, collection_name, " <- ".join(stages))
+            results.append({
+                "query": description,
+                "collection": collection_name,
+                "stages": stages,
+                "collscan": collscan
+            })
+        return results
+
+    def list_indexes(self):
+        """Get the existing index names per declared collection"""
+        return {
+            collection_name: [index["name"] for index in self.db[collection_name].list_indexes()]
+            for collection_name in self.indexes
+        }
+
+    def ensure_in_background(self):
+        """Create indexes and check plans on a daemon thread, once per process"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._ensure_and_check, name="ensure-indexes", daemon=True).start()
+
+    def _ensure_and_check(self):
+        try:
+            self.ensure()
+            self.check_query_plans()
+        except Exception:
+            logger.exception("Index check failed")
+
+def plan_stages(plan):
+    """Flatten a winning plan into its stage names, outermost first"""
+    # Slot-based engine plans wrap the classic plan in queryPlan
+    plan = plan.get("queryPlan", plan)
+    stages = []
+    while plan:
+        stages.append(plan.get("stage"))
+        if "inputStage" in plan:
+            plan = plan["inputStage"]
+        elif plan.get("inputStages"):
+            plan = plan["inputStages"][0]
+        else:
+            plan = None
+    return stages
@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+"""
+Event-Gate Edge Mode for Wedding Guest Verification System
+
+On the event day a gate instance keeps every initialized ticket in memory and
+answers scans locally, without a MongoDB round trip. Each scan is appended to
+a local journal file first and synced to MongoDB in batches by a background
+thread (write-behind), so the gate keeps working through Wi-Fi drops and
+nothing is lost if the process restarts.
+
+Several gates can run at once. They only ever send ``$inc`` deltas, so their
+scans add up in MongoDB whatever order they reconnect in, and each gate
+regularly pulls the merged counts back into its table. A ticket admitted past
+max_scans by two gates that were offline at the same time is kept (the guests
+are already in) and reported as a conflict.
+
+Each load of the table is also saved as a ticket snapshot next to the journal,
+so a gate restarted while MongoDB is unreachable starts from the snapshot
+plus its journal and keeps answering scans.
+
+The table lives in one process, so a gate must run as a single worker
+(``gunicorn --workers 1 --threads 8``). The journal is locked to enforce it:
+any other worker fails to start the gate and refuses scans.
+"""
+
+import os
+import json
+import fcntl
+import socket
+import logging
+import threading
+from datetime import datetime
+import pymongo
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from scan_events import scan_event
+
+logger = logging.getLogger(__name__)
+
+# Run /api/scan against the in-memory table instead of MongoDB
+GATE_MODE = os.environ.get('GATE_MODE', 'false').lower() == 'true'
+
+# Name of this gate in the journal and in MongoDB
+GATE_ID = os.environ.get('GATE_ID') or socket.gethostname()
+
+# Journal directory; the journal itself is <dir>/<gate id>.jsonl
+GATE_JOURNAL_DIR = os.environ.get('GATE_JOURNAL_DIR', 'gate_journal')
+
+# fsync every journal append (survives power loss, costs a disk flush per scan)
+GATE_JOURNAL_FSYNC = os.environ.get('GATE_JOURNAL_FSYNC', 'false').lower() == 'true'
+
+# Seconds between write-behind syncs, and most scans sent per bulk_write
+GATE_SYNC_SECONDS = float(os.environ.get('GATE_SYNC_SECONDS', 2))
+GATE_SYNC_BATCH = int(os.environ.get('GATE_SYNC_BATCH', 500))
+
+# Seconds between pulls of the merged scan counts of all gates
+GATE_REFRESH_SECONDS = float(os.environ.get('GATE_REFRESH_SECONDS', 30))
+
+# Seconds a scan may wait on MongoDB for a ticket missing from the table;
+# while the last sync failed there is no lookup at all
+GATE_LOOKUP_TIMEOUT = float(os.environ.get('GATE_LOOKUP_TIMEOUT', 0.5))
+
+# Seconds the start waits for MongoDB before using the ticket snapshot
+GATE_CONNECT_TIMEOUT = float(os.environ.get('GATE_CONNECT_TIMEOUT', 2))
+
+class GateModeError(Exception):
+    """Raised when gate mode cannot start, e.g. a second worker on the same journal"""
+
+class Ticket:
+    """One initialized ticket in the gate's table"""
+
+    __slots__ = ("name", "qr_number", "scan_count", "max_scans", "applied_seq")
+
+    def __init__(self, name, qr_number, scan_count, max_scans, applied_seq=0):
+        self.name = name
+        self.qr_number = qr_number
+        self.scan_count = scan_count
+        self.max_scans = max_scans
+        # Highest journal sequence of this gate already counted in MongoDB
+        self.applied_seq = applied_seq
+
+class GateScanner:
+    """
+    Answers scans from an in-memory ticket table with write-behind sync
+
+    Scan decisions and journal appends happen under one lock, so journal
+    order is decision order. Every scan, rejected ones included, is
+    journaled. The sync thread writes the journaled scans to scan_events
+    (with ``<gate id>:<seq>`` ids) and sends the accepted ones grouped per
+    ticket as ``$inc`` updates, guarded by the gate's last applied sequence
+    stored on the ticket (``gate_seq.<gate id>``), so a batch retried after
+    a lost acknowledgement is never counted twice.
+    """
+
+    def __init__(self, codes_collection, event_log, gate_id=None, journal_dir=None, counters=None):
+        self.codes_collection = codes_collection
+        self.event_log = event_log
+        # Optional qr_stats.StatsCounters kept current with the synced scans
+        self.counters = counters
+        self.gate_id = (gate_id or GATE_ID).replace(".", "_").replace("$", "_")
+        self.seq_field = f"gate_seq.{self.gate_id}"
+        journal_dir = journal_dir or GATE_JOURNAL_DIR
+        self.journal_path = os.path.join(journal_dir, f"{self.gate_id}.jsonl")
+        self.checkpoint_path = self.journal_path + ".checkpoint"
+        self.snapshot_path = self.journal_path + ".tickets.json"
+
+        self.tickets = {}
+        self.pending = []
+        self.pending_counts = {}
+        self.conflicts = {}
+        self.next_seq = 1
+        self.last_sync_at = None
+        self.last_sync_error = None
+        self.last_refresh_at = None
+        # Where the table came from: 'mongodb', 'snapshot', or None while
+        # MongoDB is unreachable and there is no snapshot yet
+        self.ticket_source = None
+        self.start_error = None
+
+        self._lock = threading.Lock()
+        self._journal = None
+        self._thread = None
+        self._wakeup = threading.Event()
+
+    @property
+    def ready(self):
+        """Whether the gate has started and answers scans"""
+        return self._thread is not None
+
+    def start(self):
+        """
+        Load the table, replay the journal and start the sync thread (idempotent)
+
+        When MongoDB is unreachable the table is loaded from the ticket
+        snapshot instead, or by the sync thread once MongoDB answers if there
+        is none; scans are answered and journaled meanwhile. Raises
+        GateModeError when another process holds the journal; a failed start
+        leaves nothing behind and can be retried.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            try:
+                self._open_journal()
+                try:
+                    self._load_tickets()
+                except PyMongoError as e:
+                    logger.warning("Gate %s: MongoDB unreachable at start (%s), using the ticket snapshot", self.gate_id, e)
+                    self.last_sync_error = str(e)
+                    self._load_snapshot()
+                self._replay_journal()
+            except Exception as e:
+                if str(e) != self.start_error:
+                    logger.error("Gate %s could not start: %s", self.gate_id, e, exc_info=not isinstance(e, GateModeError))
+                self.start_error = str(e)
+                self._reset()
+                raise
+            self.start_error = None
+            self._thread = threading.Thread(target=self._sync_forever, name="gate-sync", daemon=True)
+            self._thread.start()
+        logger.info(
+            "Gate %s ready: %d tickets from %s, %d scans waiting to sync",
+            self.gate_id, len(self.tickets), self.ticket_source or "nowhere yet", len(self.pending)
+        )
+
+    def scan(self, code_id, scanned_at=None, device_id=None):
+        """
+        Process a scan at this gate; same responses as QRCodeManager.scan_qr_code
+
+        ``scanned_at`` keeps the original time of a scan replayed from a device
+        queue (default: now).
+        """
+        scanned_at = scanned_at or datetime.utcnow()
+        with self._lock:
+            ticket = self.tickets.get(code_id)
+        if ticket is None:
+            # Not initialized when the table was loaded; check MongoDB once
+            ticket, rejection = self._fetch_ticket(code_id)
+            if rejection:
+                with self._lock:
+                    self._append(code_id, scanned_at, rejection, device_id)
+                return rejection
+
+        with self._lock:
+            if ticket.scan_count >= ticket.max_scans:
+                result = {
+                    "status": "invalid",
+                    "reason": f"Maximum scans ({ticket.max_scans}) already used"
+                }
+            else:
+                ticket.scan_count += 1
+                result = {
+                    "status": "valid",
+                    "name": ticket.name,
+                    "scans_left": ticket.max_scans - ticket.scan_count,
+                    "qr_number": ticket.qr_number
+                }
+            self._append(code_id, scanned_at, result, device_id)
+            return result
+
+    def add_ticket(self, code_id, name, qr_number=None, scan_count=0, max_scans=2):
+        """Add a ticket initialized while the gate is running"""
+        with self._lock:
+            if code_id not in self.tickets:
+                self.tickets[code_id] = Ticket(name, qr_number, scan_count, max_scans)
+
+    def sync(self):
+        """
+        Send pending scans to MongoDB, one bulk_write per GATE_SYNC_BATCH
+
+        Returns:
+            int: Number of scans synced
+        """
+        synced = 0
+        while True:
+            with self._lock:
+                batch = self.pending[:GATE_SYNC_BATCH]
+            if not batch:
+                return synced
+
+            # Events first: once a ticket's count is applied, its events are in
+            self.event_log.record_many([
+                scan_event(
+                    entry["code_id"],
+                    {"status": entry["result"], "reason": entry.get("reason"), "qr_number": entry.get("qr_number")},
+                    entry["ts"],
+                    entry.get("device_id"),
+                    source=f"gate:{self.gate_id}",
+                    event_id=f"{self.gate_id}:{entry['seq']}"
+                )
+                for entry in batch
+            ])
+
+            # One update per ticket: all its accepted scans in this batch as one $inc
+            grouped = {}
+            for entry in batch:
+                if entry["result"] == "valid":
+                    grouped.setdefault(entry["code_id"], []).append(entry)
+            operations = [
+                UpdateOne(
+                    {
+                        "code_id": code_id,
+                        "$or": [
+                            {self.seq_field: {"$exists": False}},
+                            {self.seq_field: {"$lt": entries[0]["seq"]}}
+                        ]
+                    },
+                    {
+                        "$inc": {"scan_count": len(entries)},
+                        "$set": {self.seq_field: entries[-1]["seq"]}
+                    }
+                )
+                for code_id, entries in grouped.items()
+            ]
+            if operations:
+                self.codes_collection.bulk_write(operations, ordered=False)
+                if self.counters:
+                    self._count_synced(grouped)
+
+            last_seq = batch[-1]["seq"]
+            self._write_checkpoint(last_seq)
+            with self._lock:
+                del self.pending[:len(batch)]
+                for code_id, entries in grouped.items():
+                    self._settle(code_id, len(entries), entries[-1]["seq"])
+            synced += len(batch)
+            self.last_sync_at = datetime.utcnow()
+
+    def _count_synced(self, grouped):
+        """
+        Add the synced scans to the stats counters
+
+        The tickets are read back after the write: a ticket whose sequence
+        marker is this batch's last scan has its scans counted, including one
+        applied by an earlier attempt whose acknowledgement was lost.
+        """
+        docs = self.codes_collection.find(
+            {"code_id": {"$in": list(grouped)}},
+            {"_id": 0, "code_id": 1, "scan_count": 1, "max_scans": 1, "gate_seq": 1}
+        )
+        changes = []
+        for doc in docs:
+            entries = grouped[doc["code_id"]]
+            if doc.get("gate_seq", {}).get(self.gate_id) == entries[-1]["seq"]:
+                scan_count = doc.get("scan_count", 0)
+                changes.append((doc.get("max_scans", 2), scan_count - len(entries), scan_count))
+        self.counters.add_scans(changes)
+
+    def refresh(self):
+        """
+        Pull the merged scan counts of every gate back into the table
+
+        MongoDB holds the scans all gates have synced; this gate's own
+        unsynced scans are added on top. Tickets initialized meanwhile are
+        added, and tickets over max_scans are recorded as conflicts.
+        """
+        docs = list(self.codes_collection.find(
+            {"name": {"$type": "string"}},
+            {"_id": 0, "code_id": 1, "name": 1, "qr_number": 1, "scan_count": 1, "max_scans": 1, self.seq_field: 1}
+        ))
+        self._write_snapshot(docs)
+        with self._lock:
+            for doc in docs:
+                code_id = doc["code_id"]
+                scan_count = doc.get("scan_count", 0) + self.pending_counts.get(code_id, 0)
+                ticket = self.tickets.get(code_id)
+                if ticket is None:
+                    ticket = self.tickets[code_id] = Ticket(doc["name"], doc.get("qr_number"), 0, doc.get("max_scans", 2))
+                ticket.scan_count = scan_count
+                ticket.max_scans = doc.get("max_scans", 2)
+                if scan_count > ticket.max_scans:
+                    self._record_conflict(code_id, ticket)
+            self.ticket_source = "mongodb"
+        self.last_refresh_at = datetime.utcnow()
+
+    def status(self):
+        """Summary of the gate for the status endpoint"""
+        with self._lock:
+            return {
+                "gate_id": self.gate_id,
+                "tickets": len(self.tickets),
+                "ticket_source": self.ticket_source,
+                "pending_scans": len(self.pending),
+                "next_seq": self.next_seq,
+                "last_sync_at": self.last_sync_at,
+                "last_sync_error": self.last_sync_error,
+                "last_refresh_at": self.last_refresh_at,
+                "start_error": self.start_error,
+                "conflicts": list(self.conflicts.values()),
+                "journal": self.journal_path
+            }
+
+    def _reset(self):
+        # Caller holds the lock; undo a partial start
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self.tickets = {}
+        self.pending = []
+        self.pending_counts = {}
+        self.next_seq = 1
+        self.ticket_source = None
+
+    def _open_journal(self):
+        os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+        self._journal = open(self.journal_path, "a+", encoding="utf-8")
+        try:
+            fcntl.flock(self._journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._journal.close()
+            self._journal = None
+            raise GateModeError(
+                f"Journal {self.journal_path} is in use by another process; gate mode needs a single worker"
+            )
+
+    def _load_tickets(self):
+        # Starts on a request thread: find out quickly whether MongoDB answers
+        # before reading every ticket without a deadline
+        with pymongo.timeout(GATE_CONNECT_TIMEOUT):
+            self.codes_collection.find_one({}, {"_id": 1})
+        docs = list(self.codes_collection.find(
+            {"name": {"$type": "string"}},
+            {"_id": 0, "code_id": 1, "name": 1, "qr_number": 1, "scan_count": 1, "max_scans": 1, self.seq_field: 1}
+        ))
+        self._write_snapshot(docs)
+        self._fill_table(docs)
+        self.ticket_source = "mongodb"
+        self.last_refresh_at = datetime.utcnow()
+
+    def _load_snapshot(self):
+        """Fill the table from the last ticket snapshot; False when there is none"""
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            logger.warning("Gate %s: no ticket snapshot, tickets load once MongoDB is reachable", self.gate_id)
+            return False
+        self._fill_table(snapshot["tickets"])
+        self.ticket_source = "snapshot"
+        self.last_refresh_at = datetime.fromisoformat(snapshot["saved_at"])
+        return True
+
+    def _fill_table(self, docs):
+        # Caller holds the lock (or the table is not in use yet)
+        for doc in docs:
+            self.tickets[doc["code_id"]] = Ticket(
+                doc["name"],
+                doc.get("qr_number"),
+                doc.get("scan_count", 0),
+                doc.get("max_scans", 2),
+                doc.get("gate_seq", {}).get(self.gate_id, 0)
+            )
+
+    def _write_snapshot(self, docs):
+        """
+        Save the tickets as read from MongoDB next to the journal
+
+        Counts are MongoDB's, with this gate's sequence marker: scans synced
+        after the snapshot are counted again from the journal on load.
+        """
+        partial_path = self.snapshot_path + ".part"
+        try:
+            with open(partial_path, "w", encoding="utf-8") as f:
+                json.dump({"saved_at": datetime.utcnow().isoformat(), "tickets": docs}, f)
+            os.replace(partial_path, self.snapshot_path)
+        except OSError:
+            logger.exception("Gate %s: could not write the ticket snapshot", self.gate_id)
+
+    def _replay_journal(self):
+        """
+        Queue journal entries MongoDB has not seen yet and count them locally
+
+        A scan is counted on its ticket when it is newer than the ticket's
+        sequence marker: not synced yet, or synced after a snapshot the
+        table was loaded from.
+        """
+        checkpoint = self._read_checkpoint()
+        self._journal.seek(0)
+        for line in self._journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A torn last line from a crash mid-append
+                continue
+            self.next_seq = max(self.next_seq, entry["seq"] + 1)
+            ticket = self.tickets.get(entry["code_id"])
+            if entry["result"] == "valid" and ticket:
+                if entry["seq"] <= ticket.applied_seq:
+                    # Already in the loaded count (synced before the checkpoint could be written)
+                    continue
+                ticket.scan_count += 1
+            if entry["seq"] <= checkpoint:
+                continue
+            entry["ts"] = datetime.fromisoformat(entry["ts"])
+            self._queue(entry)
+
+    def _append(self, code_id, ts, result, device_id=None):
+        # Caller holds the lock
+        entry = {
+            "seq": self.next_seq,
+            "code_id": code_id,
+            "ts": ts,
+            "gate": self.gate_id,
+            "result": result["status"],
+            "reason": result.get("reason"),
+            "qr_number": result.get("qr_number"),
+            "device_id": device_id
+        }
+        self._journal.write(json.dumps(dict(entry, ts=ts.isoformat())) + "\n")
+        self._journal.flush()
+        if GATE_JOURNAL_FSYNC:
+            os.fsync(self._journal.fileno())
+        self.next_seq += 1
+        self._queue(entry)
+
+    def _queue(self, entry):
+        self.pending.append(entry)
+        if entry["result"] == "valid":
+            self.pending_counts[entry["code_id"]] = self.pending_counts.get(entry["code_id"], 0) + 1
+
+    def _settle(self, code_id, count, seq):
+        # Caller holds the lock
+        remaining = self.pending_counts.get(code_id, 0) - count
+        if remaining > 0:
+            self.pending_counts[code_id] = remaining
+        else:
+            self.pending_counts.pop(code_id, None)
+        ticket = self.tickets.get(code_id)
+        if ticket:
+            ticket.applied_seq = seq
+
+    def _fetch_ticket(self, code_id):
+        """Look up a ticket missing from the table; returns (ticket, rejection)"""
+        if self.last_sync_error is not None:
+            # Offline: the scan is answered from the table alone
+            return None, {"status": "invalid", "reason": "QR code not found"}
+        try:
+            with pymongo.timeout(GATE_LOOKUP_TIMEOUT):
+                doc = self.codes_collection.find_one(
+                    {"code_id": code_id},
+                    {"_id": 0, "name": 1, "qr_number": 1, "scan_count": 1, "max_scans": 1}
+                )
+        except PyMongoError:
+            logger.warning("Gate %s: MongoDB unreachable, unknown code %s rejected", self.gate_id, code_id)
+            return None, {"status": "invalid", "reason": "QR code not found"}
+
+        if not doc:
+            return None, {"status": "invalid", "reason": "QR code not found"}
+        if not doc.get("name"):
+            return None, {"status": "invalid", "reason": "QR code not initialized"}
+
+        with self._lock:
+            ticket = self.tickets.get(code_id)
+            if ticket is None:
+                ticket = self.tickets[code_id] = Ticket(
+                    doc["name"], doc.get("qr_number"), doc.get("scan_count", 0), doc.get("max_scans", 2)
+                )
+        return ticket, None
+
+    def _record_conflict(self, code_id, ticket):
+        # Caller holds the lock
+        if code_id not in self.conflicts:
+            logger.warning(
+                "Gate %s: ticket #%s (%s) admitted %d times across gates, max %d",
+                self.gate_id, ticket.qr_number, ticket.name, ticket.scan_count, ticket.max_scans
+            )
+        self.conflicts[code_id] = {
+            "code_id": code_id,
+            "qr_number": ticket.qr_number,
+            "name": ticket.name,
+            "scan_count": ticket.scan_count,
+            "max_scans": ticket.max_scans
+        }
+
+    def _read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_checkpoint(self, seq):
+        partial_path = self.checkpoint_path + ".part"
+        with open(partial_path, "w", encoding="utf-8") as f:
+            f.write(str(seq))
+        os.replace(partial_path, self.checkpoint_path)
+
+    def _sync_forever(self):
+        # A table not read from MongoDB is refreshed as soon as it answers
+        last_refresh = datetime.utcnow() if self.ticket_source == "mongodb" else datetime.min
+        backoff = GATE_SYNC_SECONDS
+        while True:
+            self._wakeup.wait(backoff)
+            self._wakeup.clear()
+            try:
+                self.sync()
+                if (datetime.utcnow() - last_refresh).total_seconds() >= GATE_REFRESH_SECONDS:
+                    self.refresh()
+                    last_refresh = datetime.utcnow()
+                self.last_sync_error = None
+                backoff = GATE_SYNC_SECONDS
+            except PyMongoError as e:
+                # Offline: scans stay in the journal, retry with backoff
+                self.last_sync_error = str(e)
+                backoff = min(backoff * 2, 60)
+                logger.warning("Gate %s sync failed (%d pending): %s", self.gate_id, len(self.pending), e)
+            except Exception:
+                logger.exception("Gate %s sync error", self.gate_id)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Background QR Generation Jobs for Wedding Guest Verification System
+
+This module runs large ``generate_bulk_qr_codes`` requests outside the HTTP
+request. Job state lives in MongoDB, so a job survives a worker restart: any
+worker picks it up again once the previous owner's lease has expired and
+generates the codes that are still missing.
+
+Each run of a job reserves the qr_numbers it writes from a sequence document
+with one atomic ``$inc``, so jobs running side by side, and a worker that
+writes one more chunk after losing its lease, never number codes alike.
+"""
+
+import os
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker may go without reporting progress before its job is taken over
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+
+# Seconds between checks for queued or abandoned jobs
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 5))
+
+# _id of the document in the jobs collection holding the last reserved qr_number
+QR_NUMBER_SEQUENCE_ID = "qr_number_sequence"
+
+class JobLeaseLost(Exception):
+    """Raised when another worker has taken over the job being run"""
+
+class GenerationJobRunner:
+    """
+    Queues bulk generation jobs and runs them on a background thread
+
+    Every web worker runs one of these. Jobs are claimed with an atomic
+    ``find_one_and_update`` that takes a lease, so two workers never run the
+    same job at once and an abandoned job is resumed when its lease expires.
+    """
+
+    def __init__(self, jobs_collection, codes_collection, qr_manager):
+        self.jobs_collection = jobs_collection
+        self.codes_collection = codes_collection
+        self.qr_manager = qr_manager
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the background worker thread (idempotent)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run_forever, name="generation-jobs", daemon=True)
+                self._thread.start()
+
+    def enqueue(self, count, generate_pdfs=False, batch_size=None):
+        """Create a queued generation job and return its document"""
+        now = datetime.utcnow()
+        job = {
+            "_id": str(uuid.uuid4()),
+            "status": "queued",
+            "count": count,
+            "generate_pdfs": generate_pdfs,
+            "batch_size": batch_size,
+            "first_qr_number": None,
+            "done": 0,
+            "error": None,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "created_at": now,
+            "updated_at": now,
+            "started_at": None,
+            "finished_at": None
+        }
+        self.jobs_collection.insert_one(job)
+        self._wakeup.set()
+        return job
+
+    def get_job(self, job_id):
+        """Get a job document by id"""
+        return self.jobs_collection.find_one({"_id": job_id, "status": {"$exists": True}})
+
+    def get_progress(self, job):
+        """Summarize a job document as done/total, rate and ETA"""
+        total = job["count"]
+        done = job.get("done", 0)
+        rate = None
+        eta_seconds = None
+
+        started_at = job.get("started_at")
+        if started_at and done:
+            finished_at = job.get("finished_at") or datetime.utcnow()
+            elapsed = (finished_at - started_at).total_seconds()
+            if elapsed > 0:
+                rate = done / elapsed
+                if job["status"] in ("queued", "running"):
+                    eta_seconds = round((total - done) / rate, 1)
+
+        return {
+            "job_id": job["_id"],
+            "status": job["status"],
+            "done": done,
+            "total": total,
+            "percent": round(100.0 * done / total, 1) if total else 100.0,
+            "rate_per_second": round(rate, 2) if rate else None,
+            "eta_seconds": eta_seconds,
+            "error": job.get("error"),
+            "created_at": job.get("created_at"),
+            "started_at": job.get("started_at"),
+            "finished_at": job.get("finished_at")
+        }
+
+    def get_codes_page(self, job_id, page=1, per_page=100):
+        """Get one page of the codes written by a job, in qr_number order"""
+        return list(self.codes_collection.find(
+            {"job_id": job_id},
+            {"_id": 0, "code_id": 1, "qr_number": 1, "has_pdf": 1, "pdf_filename": 1, "pdf_error": 1}
+        ).sort("qr_number", 1).skip((page - 1) * per_page).limit(per_page))
+
+    def _reserve_qr_numbers(self, count):
+        """
+        Reserve ``count`` consecutive qr_numbers and return the first
+
+        The sequence is first raised to the highest number already written
+        (``$max``, e.g. codes generated outside jobs), then advanced with one
+        ``$inc``, so concurrent reservations get disjoint ranges.
+        """
+        last = self.codes_collection.find_one({}, {"qr_number": 1}, sort=[("qr_number", -1)])
+        self.jobs_collection.update_one(
+            {"_id": QR_NUMBER_SEQUENCE_ID},
+            {"$max": {"last": (last or {}).get("qr_number", 0)}},
+            upsert=True
+        )
+        sequence = self.jobs_collection.find_one_and_update(
+            {"_id": QR_NUMBER_SEQUENCE_ID},
+            {"$inc": {"last": count}},
+            return_document=ReturnDocument.AFTER
+        )
+        return sequence["last"] - count + 1
+
+    def _run_forever(self):
+        while True:
+            try:
+                job = self._claim_job()
+                if job:
+                    self._run_job(job)
+                    continue
+            except Exception:
+                logger.exception("Generation job worker error")
+            self._wakeup.wait(JOB_POLL_SECONDS)
+            self._wakeup.clear()
+
+    def _claim_job(self):
+        now = datetime.utcnow()
+        return self.jobs_collection.find_one_and_update(
+            {
+                "status": {"$in": ["queued", "running"]},
+                "$or": [
+                    {"lease_expires_at": None},
+                    {"lease_expires_at": {"$lt": now}}
+                ]
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "lease_owner": self.worker_id,
+                    "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "updated_at": now
+                }
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _run_job(self, job):
+        job_id = job["_id"]
+
+        # Whatever a previous owner managed to write before it died counts as done
+        done = self.codes_collection.count_documents({"job_id": job_id})
+        remaining = job["count"] - done
+        # A fresh range for this run: a previous owner still finishing a chunk
+        # writes into its own range, never this one
+        start_number = self._reserve_qr_numbers(remaining) if remaining > 0 else None
+        first_qr_number = job.get("first_qr_number") or start_number
+
+        self._update_lease(job_id, {
+            "done": done,
+            "first_qr_number": first_qr_number,
+            "started_at": job.get("started_at") or datetime.utcnow()
+        })
+        if done:
+            logger.info("Resuming generation job %s at #%d (%d/%d done)", job_id, start_number, done, job["count"])
+
+        def on_chunk(report):
+            self._update_lease(job_id, {}, inc={"done": report["size"]})
+
+        try:
+            if remaining > 0:
+                # Codes are read back page by page, nothing is kept here
+                for _ in self.qr_manager.iter_bulk_qr_codes(
+                    remaining,
+                    job.get("generate_pdfs", False),
+                    batch_size=job.get("batch_size"),
+                    progress_callback=on_chunk,
+                    start_number=start_number,
+                    job_id=job_id,
+                    # Images are rendered on demand by /api/jobs/<id>/codes
+                    include_images=False
+                ):
+                    pass
+            self._finish(job_id, "completed")
+        except JobLeaseLost:
+            logger.warning("Generation job %s was taken over by another worker", job_id)
+        except Exception as e:
+            logger.exception("Generation job %s failed", job_id)
+            self._finish(job_id, "failed", error=str(e))
+
+    def _update_lease(self, job_id, fields, inc=None):
+        now = datetime.utcnow()
+        update = {
+            "$set": dict(fields, lease_expires_at=now + timedelta(seconds=JOB_LEASE_SECONDS), updated_at=now)
+        }
+        if inc:
+            update["$inc"] = inc
+        result = self.jobs_collection.update_one({"_id": job_id, "lease_owner": self.worker_id}, update)
+        if result.matched_count == 0:
+            raise JobLeaseLost(job_id)
+
+    def _finish(self, job_id, status, error=None):
+        now = datetime.utcnow()
+        self.jobs_collection.update_one(
+            {"_id": job_id, "lease_owner": self.worker_id},
+            {
+                "$set": {
+                    "status": status,
+                    "error": error,
+                    "lease_owner": None,
+                    "lease_expires_at": None,
+                    "finished_at": now,
+                    "updated_at": now
+                }
+            }
+        )
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Guest List Import for Wedding Guest Verification System
+
+Reads guest lists (CSV or JSON) that pre-assign names to QR codes, e.g. for
+VIP and family tables, and validates each row before anything is written.
+A row names its code by ``code_id`` or ``qr_number`` and carries the guest's
+``name`` and an optional ``max_scans``.
+
+CSV files need a header row; JSON is a list of objects, or an object with
+the list under ``guests``.
+"""
+
+import csv
+import json
+
+# Columns read from each row
+GUEST_FIELDS = ("code_id", "qr_number", "name", "max_scans")
+
+class GuestImportError(ValueError):
+    """Raised when a guest list cannot be read at all"""
+
+def detect_format(filename=None, content_type=None):
+    """Pick 'csv' or 'json' from a file name or a Content-Type header"""
+    if content_type:
+        if 'json' in content_type:
+            return 'json'
+        if 'csv' in content_type or content_type.startswith('text/plain'):
+            return 'csv'
+    if filename and str(filename).lower().endswith('.json'):
+        return 'json'
+    return 'csv'
+
+def read_guest_rows(source, fmt='csv'):
+    """
+    Yield the raw rows of a guest list
+
+    Args:
+        source: Text file object (CSV is read row by row), or an already
+            decoded JSON value
+        fmt: 'csv' or 'json'
+    """
+    if fmt == 'json':
+        data = json.load(source) if hasattr(source, 'read') else source
+        rows = data.get('guests') if isinstance(data, dict) else data
+        if not isinstance(rows, list):
+            raise GuestImportError("Expected a list of guests")
+        yield from rows
+        return
+
+    reader = csv.DictReader(source)
+    if not reader.fieldnames or 'name' not in [field.strip() for field in reader.fieldnames]:
+        raise GuestImportError("CSV needs a header row with a name column and code_id or qr_number")
+    for row in reader:
+        yield {key.strip(): value for key, value in row.items() if key}
+
+def parse_guest_row(raw):
+    """
+    Validate and normalize one row
+
+    Returns:
+        tuple: (row dict with code_id, qr_number, name, max_scans; error message or None)
+    """
+    if not isinstance(raw, dict):
+        return {}, "Row is not an object"
+
+    row = {field: raw.get(field) for field in GUEST_FIELDS}
+    for field in GUEST_FIELDS:
+        if isinstance(row[field], str):
+            row[field] = row[field].strip() or None
+
+    try:
+        if row["qr_number"] is not None:
+            row["qr_number"] = int(row["qr_number"])
+        if row["max_scans"] is not None:
+            row["max_scans"] = int(row["max_scans"])
+    except (TypeError, ValueError):
+        return row, "qr_number and max_scans must be whole numbers"
+
+    if row["code_id"] is None and row["qr_number"] is None:
+        return row, "Missing code_id or qr_number"
+    if not isinstance(row["name"], str) or not row["name"]:
+        return row, "Name cannot be empty"
+    if row["max_scans"] is not None and row["max_scans"] < 1:
+        return row, "max_scans must be at least 1"
+    return row, None
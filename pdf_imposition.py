@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Print-Ready Invitation PDF for Wedding Guest Verification System
+
+This module writes every personalized invitation into one multi-page PDF for
+the printer, optionally imposed N-up onto larger sheets. The file is streamed
+to disk object by object, so memory does not grow with the page count, and
+each template page is stored once as a form XObject that every copy refers to.
+"""
+
+import io
+import os
+from pathlib import Path
+from PyPDF2.generic import (
+    ArrayObject, DictionaryObject, FloatObject, IndirectObject, NameObject, NumberObject, StreamObject
+)
+from pdf_qr_generator import _stream, build_qr_xobject, qr_placement
+from qr_renderer import build_qr_url, qr_matrix
+
+# Sheet sizes in points, portrait
+SHEET_SIZES = {
+    'A4': (595.28, 841.89),
+    'A3': (841.89, 1190.55),
+    'SRA3': (907.09, 1275.59),
+    'letter': (612, 792),
+    'tabloid': (792, 1224)
+}
+
+class StreamingPDFWriter:
+    """
+    Minimal PDF writer that appends each object to the output as it is made
+
+    Only the byte offset of every object is kept for the final xref table.
+    Objects copied from a template reader are renumbered on the way and each
+    source object is written once, however often it is referenced.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+        self.offsets = [None]
+        self.page_ids = []
+        self._imported = {}
+        self._pending = []
+        self._write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self.pages_id = self.reserve()
+
+    def reserve(self):
+        """Reserve an object number to be written later"""
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def write_object(self, obj, obj_id=None):
+        """Write a PDF object and return its object number"""
+        obj_id = obj_id or self.reserve()
+        buffer = io.BytesIO()
+        buffer.write(f"{obj_id} 0 obj\n".encode())
+        obj.write_to_stream(buffer, None)
+        buffer.write(b"\nendobj\n")
+        self.offsets[obj_id] = self.position
+        self._write(buffer.getvalue())
+        return obj_id
+
+    def import_object(self, obj):
+        """
+        Copy a (direct) object from a template reader into this file
+
+        Referenced objects are renumbered, queued and written by
+        ``flush_imports``; the returned copy refers to the new numbers.
+        """
+        if isinstance(obj, IndirectObject):
+            key = (id(obj.pdf), obj.idnum, obj.generation)
+            if key not in self._imported:
+                self._imported[key] = self.reserve()
+                self._pending.append((self._imported[key], obj))
+            return IndirectObject(self._imported[key], 0, None)
+        if isinstance(obj, StreamObject):
+            copy = obj.__class__()
+            copy._data = obj._data
+            for key, value in obj.items():
+                if key != "/Length":
+                    copy[NameObject(key)] = self.import_object(value)
+            return copy
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({
+                NameObject(key): self.import_object(value)
+                for key, value in obj.items()
+                if key != "/Parent"
+            })
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self.import_object(value) for value in obj])
+        return obj
+
+    def flush_imports(self):
+        """Write every queued template object"""
+        while self._pending:
+            obj_id, reference = self._pending.pop()
+            self.write_object(self.import_object(reference.get_object()), obj_id)
+
+    def add_page(self, width, height, content, xobjects):
+        """Write a page showing the given XObjects; ``xobjects`` maps names to object numbers"""
+        content_id = self.write_object(_stream(content))
+        page = DictionaryObject({
+            NameObject("/Type"): NameObject("/Page"),
+            NameObject("/Parent"): IndirectObject(self.pages_id, 0, None),
+            NameObject("/MediaBox"): ArrayObject([NumberObject(0), NumberObject(0), _number(width), _number(height)]),
+            NameObject("/Resources"): DictionaryObject({
+                NameObject("/XObject"): DictionaryObject({
+                    NameObject(name): IndirectObject(obj_id, 0, None) for name, obj_id in xobjects.items()
+                })
+            }),
+            NameObject("/Contents"): IndirectObject(content_id, 0, None)
+        })
+        self.page_ids.append(self.write_object(page))
+
+    def close(self):
+        """Write the page tree, catalog, xref table and trailer"""
+        self.flush_imports()
+        self.write_object(DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject([IndirectObject(page_id, 0, None) for page_id in self.page_ids]),
+            NameObject("/Count"): NumberObject(len(self.page_ids))
+        }), self.pages_id)
+        catalog_id = self.write_object(DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(self.pages_id, 0, None)
+        }))
+
+        xref_offset = self.position
+        lines = [f"xref\n0 {len(self.offsets)}\n", "0000000000 65535 f \n"]
+        lines.extend(f"{offset:010d} 00000 n \n" for offset in self.offsets[1:])
+        lines.append(f"trailer\n<< /Size {len(self.offsets)} /Root {catalog_id} 0 R >>\n")
+        lines.append(f"startxref\n{xref_offset}\n%%EOF\n")
+        self._write("".join(lines).encode())
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.position += len(data)
+
+def _number(value):
+    value = float(value)
+    return NumberObject(int(value)) if value.is_integer() else FloatObject(round(value, 4))
+
+def template_page_xobject(writer, page):
+    """Store a template page once as a form XObject and return its object number"""
+    mediabox = [float(value) for value in page.mediabox]
+
+    contents = page["/Contents"].get_object() if "/Contents" in page else None
+    if contents is None:
+        data = b""
+    elif isinstance(contents, ArrayObject):
+        data = b"\n".join(stream.get_object().get_data() for stream in contents)
+    else:
+        data = contents.get_data()
+
+    form = _stream(
+        data,
+        **{
+            "/Type": NameObject("/XObject"),
+            "/Subtype": NameObject("/Form"),
+            "/BBox": ArrayObject([_number(value) for value in mediabox]),
+            "/Resources": writer.import_object(page.raw_get("/Resources")) if "/Resources" in page else DictionaryObject()
+        }
+    )
+    return writer.write_object(form)
+
+def parse_sheet_size(sheet):
+    """Parse a sheet name from SHEET_SIZES or 'WIDTHxHEIGHT' in points"""
+    if sheet in SHEET_SIZES:
+        return SHEET_SIZES[sheet]
+    try:
+        width, height = (float(value) for value in sheet.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"Unknown sheet size: {sheet}")
+    return width, height
+
+def plan_layout(page_size, n_up, sheet=None):
+    """
+    Work out how ``n_up`` template pages fit on a sheet
+
+    Tries every grid with n_up cells in both sheet orientations and keeps the
+    one that allows the largest scale.
+
+    Returns:
+        dict: sheet width/height, columns, rows, scale and slot origins
+    """
+    page_width, page_height = page_size
+    if n_up == 1 and sheet is None:
+        return {"width": page_width, "height": page_height, "slots": [(0, 0)], "scale": 1}
+
+    if sheet is None:
+        sheet = 'A3'
+    if isinstance(sheet, str):
+        sheet = parse_sheet_size(sheet)
+
+    best = None
+    for sheet_width, sheet_height in (sheet, (sheet[1], sheet[0])):
+        for columns in range(1, n_up + 1):
+            if n_up % columns:
+                continue
+            rows = n_up // columns
+            scale = min(sheet_width / (columns * page_width), sheet_height / (rows * page_height), 1)
+            if best is None or scale > best[0] + 1e-9:
+                best = (scale, sheet_width, sheet_height, columns, rows)
+
+    scale, sheet_width, sheet_height, columns, rows = best
+    # Center the grid, fill slots left to right, top to bottom
+    margin_x = (sheet_width - columns * page_width * scale) / 2
+    margin_y = (sheet_height - rows * page_height * scale) / 2
+    slots = [
+        (margin_x + column * page_width * scale, sheet_height - margin_y - (row + 1) * page_height * scale)
+        for row in range(rows)
+        for column in range(columns)
+    ]
+    return {"width": sheet_width, "height": sheet_height, "slots": slots, "scale": scale}
+
+def write_print_pdf(generator, codes_data, output_path, n_up=1, sheet=None, pages=None, qr_mode=None,
+                    progress_callback=None):
+    """
+    Write all invitations into a single print-ready PDF
+
+    Args:
+        generator: PDFQRGenerator providing the template, base URL and QR position
+        codes_data: Iterable of dicts with code_id and qr_number, in print order
+        n_up: Template pages per sheet (1 keeps the template page size unless
+            ``sheet`` is given)
+        sheet: Sheet name from SHEET_SIZES, 'WIDTHxHEIGHT' or (width, height) in points
+        pages: Zero-based template pages to include per invitation (default: all)
+        progress_callback: Called as (invitations done, record) after each invitation
+
+    Returns:
+        dict: Summary with file path, invitation, page and sheet counts, size
+    """
+    template = generator.get_template()
+    if template.page_count < 2:
+        return {"success": False, "error": "PDF must have at least 2 pages"}
+
+    pages = list(range(template.page_count)) if pages is None else list(pages)
+    page_size = template.qr_page_size
+    layout = plan_layout(page_size, n_up, sheet)
+    slots = layout["slots"]
+    x_pos, y_pos = generator.qr_position(*page_size)
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = output_path.with_name(output_path.name + ".part")
+
+    invitations = 0
+    with open(partial_path, 'wb') as output_file:
+        writer = StreamingPDFWriter(output_file)
+
+        # Template pages are written once, before any invitation
+        with template.lock:
+            forms = {index: template_page_xobject(writer, template.reader.pages[index]) for index in pages}
+            origins = {index: template.reader.pages[index].mediabox.lower_left for index in pages}
+            writer.flush_imports()
+
+        sheet_content = []
+        sheet_xobjects = {}
+
+        def place(page_index, qr_id):
+            slot = len(sheet_content)
+            slot_x, slot_y = slots[slot]
+            origin_x, origin_y = (float(value) for value in origins[page_index])
+            form_name = f"/T{page_index}"
+            sheet_xobjects[form_name] = forms[page_index]
+
+            # Slot transform, then the page's own coordinates (mediabox origin)
+            ops = (
+                f"q {layout['scale']:.6g} 0 0 {layout['scale']:.6g} {slot_x:.2f} {slot_y:.2f} cm "
+                f"1 0 0 1 {-origin_x:.2f} {-origin_y:.2f} cm {form_name} Do "
+            ).encode()
+            if qr_id is not None:
+                qr_name = f"/Q{slot}"
+                sheet_xobjects[qr_name] = qr_id
+                ops += qr_placement(x_pos, y_pos, name=qr_name)
+            sheet_content.append(ops + b"Q\n")
+
+            if len(sheet_content) == len(slots):
+                flush_sheet()
+
+        def flush_sheet():
+            writer.add_page(layout["width"], layout["height"], b"".join(sheet_content), dict(sheet_xobjects))
+            sheet_content.clear()
+            sheet_xobjects.clear()
+
+        for code_data in codes_data:
+            code_id = code_data.get('code_id')
+            qr_id = None
+            if 1 in pages:
+                matrix = qr_matrix(build_qr_url(generator.base_url, code_id))
+                qr_id = writer.write_object(build_qr_xobject(matrix, qr_mode))
+            for page_index in pages:
+                place(page_index, qr_id if page_index == 1 else None)
+
+            invitations += 1
+            if progress_callback:
+                progress_callback(invitations, code_data)
+
+        if sheet_content:
+            flush_sheet()
+
+        writer.close()
+        size_bytes = writer.position
+        page_count = len(writer.page_ids)
+
+    os.replace(partial_path, output_path)
+
+    return {
+        "success": True,
+        "file_path": str(output_path),
+        "invitations": invitations,
+        "pages_per_invitation": len(pages),
+        "sheets": page_count,
+        "n_up": len(slots),
+        "size_bytes": size_bytes
+    }
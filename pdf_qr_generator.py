@@ -3,79 +3,254 @@
 PDF QR Code Embedding Utility for Wedding Guest Verification System
 
 This module handles embedding QR codes into the wedding invitation PDF.
+The template is parsed once per process and shared; each invitation only
+adds the QR code XObject and a short content stream to its second page.
 """
 
 import os
 import io
+import zlib
 import base64
+import hashlib
+import threading
+import multiprocessing
 from pathlib import Path
-import qrcode
-from PIL import Image, ImageDraw
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
 from PyPDF2 import PdfReader, PdfWriter
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.utils import ImageReader
-import tempfile
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, NameObject, NumberObject
+)
+from qr_renderer import (
+    QR_BORDER, QR_ERROR_CORRECTION, QR_IMAGE_SIZE, build_qr_url, iter_module_runs, qr_matrix, rasterize, render_qr_pil
+)
+
+# Printed size of the QR code on the invitation, in points
+QR_PDF_SIZE = 120
+
+# How the QR code is put on the invitation: 'vector' or 'raster'
+QR_PDF_MODE = os.environ.get('QR_PDF_MODE', 'vector')
+
+# Processes for bulk PDF generation; 0 means one per CPU core, 1 runs in-process
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', 0))
+
+# Where embed_qr_in_pdf puts the finished invitation
+PDF_OUTPUT_MODES = ('file', 'bytes', 'both')
+
+# Resource name of the QR code XObject on the invitation page
+QR_XOBJECT_NAME = "/WeddingQR"
+
+# Bump whenever a code change alters the PDF output, so render keys of
+# invitations written by older code stop matching
+PDF_RENDER_VERSION = 1
+
+class PDFTemplate:
+    """A parsed invitation template, shared by every invitation of this process"""
+
+    def __init__(self, path, data, mtime):
+        self.path = path
+        self.mtime = mtime
+        self.sha256 = hashlib.sha256(data).hexdigest()
+        self.size = len(data)
+        self.reader = PdfReader(io.BytesIO(data))
+        self.page_count = len(self.reader.pages)
+        self.qr_page_size = None
+        if self.page_count >= 2:
+            mediabox = self.reader.pages[1].mediabox
+            self.qr_page_size = (float(mediabox.width), float(mediabox.height))
+        # The reader resolves objects lazily from one shared stream
+        self.lock = threading.Lock()
+
+    def copy_pages(self, writer):
+        """Add every template page to the writer and return the writer's copies"""
+        with self.lock:
+            return [writer.add_page(page) for page in self.reader.pages]
+
+_template_cache = {}
+_template_cache_lock = threading.Lock()
+
+def load_template(path):
+    """
+    Get the parsed template at path, loading it at most once per process
+
+    Every call compares the file's mtime with the cached copy. A changed mtime
+    re-reads the file, but it is only parsed again if its SHA-256 changed too.
+    """
+    path = Path(path)
+    mtime = path.stat().st_mtime_ns
+    key = str(path.resolve())
+
+    with _template_cache_lock:
+        template = _template_cache.get(key)
+        if template and template.mtime == mtime:
+            return template
+
+        data = path.read_bytes()
+        if template and template.sha256 == hashlib.sha256(data).hexdigest():
+            template.mtime = mtime
+            return template
+
+        template = PDFTemplate(path, data, mtime)
+        _template_cache[key] = template
+        return template
+
+def _stream(data, **entries):
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    if len(data) > 64:
+        stream = stream.flate_encode()
+    for key, value in entries.items():
+        stream[NameObject(key)] = value
+    return stream
+
+def build_qr_xobject(matrix, qr_mode=None):
+    """
+    Build a QR module matrix as a PDF XObject covering the unit square
+
+    'vector' gives a form XObject whose dark modules are filled rectangles,
+    'raster' a 1-bit image XObject at QR_IMAGE_SIZE pixels. Both are placed
+    with the same ``qr_placement`` content stream.
+    """
+    modules = matrix.shape[0]
+
+    if (qr_mode or QR_PDF_MODE) == 'raster':
+        pixels = rasterize(matrix)
+        # DeviceGray 1-bit: 0 is black, so invert the dark-module mask
+        packed = np.packbits(1 - pixels, axis=1).tobytes()
+        image = DecodedStreamObject()
+        image._data = zlib.compress(packed)
+        image.update({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Image"),
+            NameObject("/Width"): NumberObject(pixels.shape[1]),
+            NameObject("/Height"): NumberObject(pixels.shape[0]),
+            NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+            NameObject("/BitsPerComponent"): NumberObject(1),
+            NameObject("/Filter"): NameObject("/FlateDecode")
+        })
+        return image
+
+    # Module units, y flipped so row 0 is at the top
+    rects = "".join(
+        f"{col} {modules - 1 - row} {length} 1 re\n"
+        for row, col, length in iter_module_runs(matrix)
+    )
+    content = f"1 1 1 rg 0 0 {modules} {modules} re f\n0 0 0 rg\n{rects}f\n".encode()
+    scale = FloatObject(1 / modules)
+    return _stream(
+        content,
+        **{
+            "/Type": NameObject("/XObject"),
+            "/Subtype": NameObject("/Form"),
+            "/BBox": ArrayObject([NumberObject(0), NumberObject(0), NumberObject(modules), NumberObject(modules)]),
+            "/Matrix": ArrayObject([scale, NumberObject(0), NumberObject(0), scale, NumberObject(0), NumberObject(0)])
+        }
+    )
+
+def qr_placement(x_pos, y_pos, qr_size=QR_PDF_SIZE, name=QR_XOBJECT_NAME):
+    """Content stream operators that draw a unit-square XObject at the QR spot"""
+    return f"q {qr_size:g} 0 0 {qr_size:g} {x_pos:.2f} {y_pos:.2f} cm {name} Do Q\n".encode()
+
+def stamp_qr(writer, page, xobject, x_pos, y_pos, qr_size=QR_PDF_SIZE):
+    """
+    Draw a QR XObject on a page that has already been added to the writer
+
+    The page's own content is wrapped in q/Q so whatever graphics state it
+    leaves behind cannot leak into the QR code; it is never parsed.
+    """
+    # Either may be an indirect object shared with other pages: copy the
+    # resolved dictionaries rather than adding to them
+    resources = DictionaryObject(page["/Resources"].get_object() if "/Resources" in page else {})
+    xobjects = DictionaryObject(resources["/XObject"].get_object() if "/XObject" in resources else {})
+    xobjects[NameObject(QR_XOBJECT_NAME)] = writer._add_object(xobject)
+    resources[NameObject("/XObject")] = xobjects
+    page[NameObject("/Resources")] = resources
+
+    contents = page.raw_get("/Contents") if "/Contents" in page else None
+    if contents is None:
+        original = []
+    elif isinstance(contents.get_object(), ArrayObject):
+        original = list(contents.get_object())
+    else:
+        original = [contents]
+
+    page[NameObject("/Contents")] = ArrayObject(
+        [writer._add_object(_stream(b"q\n"))]
+        + original
+        + [writer._add_object(_stream(b"\nQ\n" + qr_placement(x_pos, y_pos, qr_size)))]
+    )
 
 class PDFQRGenerator:
     def __init__(self, base_url="https://doublehaffairs.vercel.app"):
         self.base_url = base_url
         self.pdf_template_path = Path("DoubleHaffairs .pdf")
+        self._pool = None
+        self._pool_workers = None
         
-    def create_qr_code_image(self, code_id, size=(100, 100)):
-        """Generate QR code image"""
-        qr_url = f"{self.base_url}/init?code={code_id}"
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(qr_url)
-        qr.make(fit=True)
-        
-        # Create QR code image
-        qr_img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Resize to specified size
-        qr_img = qr_img.resize(size, Image.Resampling.LANCZOS)
-        
-        return qr_img
+    def create_qr_code_image(self, code_id, size=(QR_IMAGE_SIZE, QR_IMAGE_SIZE)):
+        """Generate QR code image (same renderer and settings as the API)"""
+        qr_url = build_qr_url(self.base_url, code_id)
+        return render_qr_pil(qr_url, size_px=size[0])
     
-    def create_qr_overlay_pdf(self, qr_img, page_width, page_height):
-        """Create a PDF overlay with the QR code positioned in the middle of the page"""
-        # Create a temporary file for the overlay
-        overlay_buffer = io.BytesIO()
-        
-        # Create canvas with same dimensions as the original page
-        c = canvas.Canvas(overlay_buffer, pagesize=(page_width, page_height))
-        
-        # Convert PIL image to reportlab ImageReader
-        qr_buffer = io.BytesIO()
-        qr_img.save(qr_buffer, format='PNG')
-        qr_buffer.seek(0)
-        qr_image_reader = ImageReader(qr_buffer)
-        
+    def qr_position(self, page_width, page_height, qr_size=QR_PDF_SIZE):
+        """Bottom-left corner of the QR code on the invitation page"""
         # Calculate position to place QR code lower on page
-        qr_width, qr_height = qr_img.size
-        x_pos = (page_width - qr_width) / 2
+        x_pos = (page_width - qr_size) / 2
         # Move QR code down by 150 points from center
-        y_pos = (page_height - qr_height) / 2 - 67
-        
-        # Draw QR code on canvas
-        c.drawImage(qr_image_reader, x_pos, y_pos, width=qr_width, height=qr_height)
-        c.save()
+        y_pos = (page_height - qr_size) / 2 - 67
+        return x_pos, y_pos
+    
+    def create_qr_xobject(self, code_id, qr_mode=None):
+        """Build the code's QR as a PDF XObject (see build_qr_xobject)"""
+        return build_qr_xobject(qr_matrix(build_qr_url(self.base_url, code_id)), qr_mode)
+    
+    def get_template(self):
+        """Get the parsed invitation template (cached per process)"""
+        return load_template(self.pdf_template_path)
+    
+    def render_key(self, code_id, qr_mode=None):
+        """
+        Content address of an invitation: hash of everything its bytes depend on
         
-        overlay_buffer.seek(0)
-        return overlay_buffer
+        The template hash, the code, the encoded URL and the QR settings. Two
+        invitations with the same key are interchangeable, so a stored PDF whose
+        key still matches never needs to be rendered again.
+        """
+        parts = [
+            PDF_RENDER_VERSION,
+            self.get_template().sha256,
+            build_qr_url(self.base_url, code_id),
+            qr_mode or QR_PDF_MODE,
+            QR_PDF_SIZE,
+            QR_BORDER,
+            QR_ERROR_CORRECTION
+        ]
+        return hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest()[:32]
     
-    def embed_qr_in_pdf(self, code_id, qr_number=None):
+    def embed_qr_in_pdf(self, code_id, qr_number=None, qr_mode=None, output_mode='file', include_base64=False):
         """
         Embed QR code into the second page of the wedding invitation PDF
         
+        Args:
+            qr_mode: 'vector' draws the QR as rectangles, 'raster' embeds a 1-bit image
+                (default: QR_PDF_MODE)
+            output_mode: 'file' writes to qr_pdfs/, 'bytes' keeps the PDF in
+                memory only, 'both' does both from a single serialization
+            include_base64: Also return the PDF base64 encoded
+        
         Returns:
-            dict: Contains success status, file path, and base64 encoded PDF
+            dict: Contains success status and size, plus the file path
+                ('file'/'both'), pdf_bytes ('bytes'/'both') and pdf_base64
+                (only with include_base64)
         """
+        if output_mode not in PDF_OUTPUT_MODES:
+            return {
+                "success": False,
+                "error": f"Unknown output mode: {output_mode}"
+            }
+        
         try:
             if not self.pdf_template_path.exists():
                 return {
@@ -83,106 +258,252 @@ class PDFQRGenerator:
                     "error": f"Template PDF not found: {self.pdf_template_path}"
                 }
             
-            # Read the original PDF
-            with open(self.pdf_template_path, 'rb') as pdf_file:
-                pdf_reader = PdfReader(pdf_file)
-                pdf_writer = PdfWriter()
-                
-                # Check if PDF has at least 2 pages
-                if len(pdf_reader.pages) < 2:
-                    return {
-                        "success": False,
-                        "error": "PDF must have at least 2 pages"
-                    }
-                
-                # Copy first page as-is
-                pdf_writer.add_page(pdf_reader.pages[0])
-                
-                # Get second page dimensions
-                second_page = pdf_reader.pages[1]
-                page_rect = second_page.mediabox
-                page_width = float(page_rect.width)
-                page_height = float(page_rect.height)
-                
-                # Generate QR code image
-                qr_img = self.create_qr_code_image(code_id, size=(120, 120))
-                
-                # Create QR overlay PDF
-                overlay_buffer = self.create_qr_overlay_pdf(qr_img, page_width, page_height)
-                
-                # Read overlay PDF
-                overlay_reader = PdfReader(overlay_buffer)
-                overlay_page = overlay_reader.pages[0]
-                
-                # Merge second page with QR overlay
-                second_page.merge_page(overlay_page)
-                pdf_writer.add_page(second_page)
-                
-                # Add remaining pages if any
-                for i in range(2, len(pdf_reader.pages)):
-                    pdf_writer.add_page(pdf_reader.pages[i])
-                
-                # Generate output filename
-                output_filename = f"invitation_qr_{qr_number or 'custom'}_{code_id[:8]}.pdf"
-                output_path = Path("qr_pdfs") / output_filename
-                output_path.parent.mkdir(exist_ok=True)
-                
-                # Save the modified PDF
-                with open(output_path, 'wb') as output_file:
-                    pdf_writer.write(output_file)
-                
-                # Convert to base64 for API response
-                with open(output_path, 'rb') as pdf_file:
-                    pdf_base64 = base64.b64encode(pdf_file.read()).decode()
-                
+            template = self.get_template()
+            
+            # Check if PDF has at least 2 pages
+            if template.page_count < 2:
                 return {
-                    "success": True,
-                    "file_path": str(output_path),
-                    "filename": output_filename,
-                    "pdf_base64": pdf_base64,
-                    "code_id": code_id,
-                    "qr_number": qr_number
+                    "success": False,
+                    "error": "PDF must have at least 2 pages"
                 }
-                
+            
+            # Copy the template pages; only the second one is changed below
+            pdf_writer = PdfWriter()
+            pages = template.copy_pages(pdf_writer)
+            
+            # Stamp the QR code onto the second page
+            page_width, page_height = template.qr_page_size
+            x_pos, y_pos = self.qr_position(page_width, page_height)
+            stamp_qr(pdf_writer, pages[1], self.create_qr_xobject(code_id, qr_mode), x_pos, y_pos)
+            
+            # Generate output filename
+            output_filename = f"invitation_qr_{qr_number or 'custom'}_{code_id[:8]}.pdf"
+            result = {
+                "success": True,
+                "filename": output_filename,
+                "code_id": code_id,
+                "qr_number": qr_number,
+                "render_key": self.render_key(code_id, qr_mode)
+            }
+            
+            # The writer serializes once, straight into the file when only the
+            # file is wanted, otherwise into memory; nothing is read back.
+            # Files are written under a temporary name and renamed, so a crash
+            # never leaves a truncated invitation under the real name
+            pdf_bytes = None
+            output_path = Path("qr_pdfs") / output_filename
+            partial_path = output_path.with_name(output_filename + ".part")
+            if output_mode == 'file' and not include_base64:
+                output_path.parent.mkdir(exist_ok=True)
+                with open(partial_path, 'wb') as output_file:
+                    pdf_writer.write(output_file)
+                    result["size_bytes"] = output_file.tell()
+                os.replace(partial_path, output_path)
+            else:
+                buffer = io.BytesIO()
+                pdf_writer.write(buffer)
+                pdf_bytes = buffer.getvalue()
+                result["size_bytes"] = len(pdf_bytes)
+                if output_mode in ('file', 'both'):
+                    output_path.parent.mkdir(exist_ok=True)
+                    partial_path.write_bytes(pdf_bytes)
+                    os.replace(partial_path, output_path)
+            
+            if output_mode in ('file', 'both'):
+                result["file_path"] = str(output_path)
+            if output_mode in ('bytes', 'both'):
+                result["pdf_bytes"] = pdf_bytes
+            if include_base64:
+                result["pdf_base64"] = base64.b64encode(pdf_bytes).decode()
+            
+            return result
+            
         except Exception as e:
             return {
                 "success": False,
                 "error": f"Failed to embed QR code in PDF: {str(e)}"
             }
     
-    def generate_bulk_pdf_qr_codes(self, codes_data):
+    def generate_bulk_pdf_qr_codes(self, codes_data, workers=None, qr_mode=None, progress_callback=None):
         """
         Generate multiple PDF invitations with embedded QR codes
         
         Args:
-            codes_data: List of dicts with code_id and qr_number
+            codes_data: Iterable of dicts with code_id and qr_number
+            workers: Worker processes (default: PDF_WORKERS, 1 = in-process)
+            progress_callback: Called as (done, total, record) after every invitation
             
         Returns:
-            dict: Results of bulk generation
+            dict: Results of bulk generation, one compact record per invitation
         """
         results = []
         successful_count = 0
         failed_count = 0
         
-        for code_data in codes_data:
-            code_id = code_data.get('code_id')
-            qr_number = code_data.get('qr_number')
-            
-            result = self.embed_qr_in_pdf(code_id, qr_number)
-            results.append(result)
+        for record in self.iter_bulk_pdf_qr_codes(codes_data, workers, qr_mode, progress_callback):
+            results.append(record)
             
-            if result.get('success'):
+            if record.get('success'):
                 successful_count += 1
             else:
                 failed_count += 1
         
         return {
             "success": True,
-            "total_processed": len(codes_data),
+            "total_processed": len(results),
             "successful_count": successful_count,
             "failed_count": failed_count,
             "results": results
         }
+    
+    def iter_bulk_pdf_qr_codes(self, codes_data, workers=None, qr_mode=None, progress_callback=None):
+        """
+        Generate PDF invitations on a process pool, yielding compact records
+        
+        Each worker process keeps its own cached template. At most a few
+        invitations per worker are in flight and results are yielded as they
+        complete, so memory stays flat however many codes are passed. A failure
+        is reported on that invitation's record and never stops the batch.
+        When a worker crashes, the pool is restarted once and the invitations
+        that were in flight are retried one at a time, so only the one that
+        crashes again is reported failed.
+        
+        Yields:
+            dict: code_id, qr_number, success, file_path, filename, size_bytes,
+            render_key, error
+        """
+        total = len(codes_data) if hasattr(codes_data, '__len__') else None
+        done = 0
+        
+        for record in self._run_bulk(iter(codes_data), workers, qr_mode):
+            done += 1
+            if progress_callback:
+                progress_callback(done, total, record)
+            yield record
+    
+    def shutdown(self):
+        """Stop the PDF worker processes, if any were started"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+    
+    def _run_bulk(self, codes, workers, qr_mode):
+        workers = workers if workers is not None else PDF_WORKERS
+        workers = workers if workers > 0 else (os.cpu_count() or 1)
+        
+        if workers == 1:
+            for code_data in codes:
+                yield _embed_compact(self, code_data.get('code_id'), code_data.get('qr_number'), qr_mode)
+            return
+        
+        pool = self._get_pool(workers)
+        in_flight = {}
+        max_in_flight = workers * 4
+        exhausted = False
+        # Invitations in flight when a worker crashed; each is retried alone,
+        # so a crash while one runs by itself identifies the culprit
+        suspects = deque()
+        
+        while in_flight or suspects or not exhausted:
+            # Keep the pool fed without reading all codes up front
+            while not suspects and not exhausted and len(in_flight) < max_in_flight:
+                code_data = next(codes, None)
+                if code_data is None:
+                    exhausted = True
+                    break
+                code = (code_data.get('code_id'), code_data.get('qr_number'))
+                in_flight[pool.submit(_embed_in_worker, *code, qr_mode)] = code
+            if suspects and not in_flight:
+                code = suspects.popleft()
+                in_flight[pool.submit(_embed_in_worker, *code, qr_mode)] = code
+                isolated = True
+            elif not suspects:
+                isolated = False
+            
+            if not in_flight:
+                break
+            
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            if any(isinstance(future.exception(), BrokenProcessPool) for future in finished):
+                # A worker died and took the pool with it: restart it once
+                pool = self._get_pool(workers, restart=True)
+                if isolated:
+                    code_id, qr_number = in_flight.popitem()[1]
+                    yield _failed_record(code_id, qr_number, "PDF worker crashed on this invitation")
+                    continue
+                # Keep what finished before the crash, retry the rest
+                for future, (code_id, qr_number) in list(in_flight.items()):
+                    if future.done() and future.exception() is None:
+                        yield future.result()
+                    elif future.done() and not isinstance(future.exception(), BrokenProcessPool):
+                        yield _failed_record(code_id, qr_number, f"Failed to embed QR code in PDF: {future.exception()}")
+                    else:
+                        suspects.append((code_id, qr_number))
+                in_flight.clear()
+                continue
+            
+            for future in finished:
+                code_id, qr_number = in_flight.pop(future)
+                try:
+                    yield future.result()
+                except Exception as e:
+                    yield _failed_record(code_id, qr_number, f"Failed to embed QR code in PDF: {str(e)}")
+    
+    def _get_pool(self, workers, restart=False):
+        if restart or (self._pool is not None and self._pool_workers != workers):
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_pdf_worker,
+                initargs=(self.base_url, str(self.pdf_template_path))
+            )
+            self._pool_workers = workers
+        return self._pool
+
+# Generator of the current PDF worker process, with its own template cache
+_worker_generator = None
+
+def _init_pdf_worker(base_url, template_path):
+    global _worker_generator
+    _worker_generator = PDFQRGenerator(base_url=base_url)
+    _worker_generator.pdf_template_path = Path(template_path)
+    if _worker_generator.pdf_template_path.exists():
+        _worker_generator.get_template()
+
+def _embed_in_worker(code_id, qr_number, qr_mode):
+    return _embed_compact(_worker_generator, code_id, qr_number, qr_mode)
+
+def _embed_compact(generator, code_id, qr_number, qr_mode):
+    """Embed one invitation and reduce the result to a compact record"""
+    result = generator.embed_qr_in_pdf(code_id, qr_number, qr_mode=qr_mode)
+    if not result.get('success'):
+        return _failed_record(code_id, qr_number, result.get('error'))
+    return {
+        "code_id": code_id,
+        "qr_number": qr_number,
+        "success": True,
+        "file_path": result['file_path'],
+        "filename": result['filename'],
+        "size_bytes": result['size_bytes'],
+        "render_key": result['render_key'],
+        "error": None
+    }
+
+def _failed_record(code_id, qr_number, error):
+    return {
+        "code_id": code_id,
+        "qr_number": qr_number,
+        "success": False,
+        "file_path": None,
+        "filename": None,
+        "size_bytes": 0,
+        "render_key": None,
+        "error": error
+    }
 
 def main():
     """Command line interface for PDF QR generation"""
@@ -192,11 +513,12 @@ def main():
     parser.add_argument('--code-id', required=True, help='QR code ID')
     parser.add_argument('--qr-number', type=int, help='QR number for filename')
     parser.add_argument('--output-dir', default='qr_pdfs', help='Output directory')
+    parser.add_argument('--qr-mode', choices=['vector', 'raster'], help='Draw the QR as vector rectangles or a 1-bit image (default: QR_PDF_MODE)')
     
     args = parser.parse_args()
     
     generator = PDFQRGenerator()
-    result = generator.embed_qr_in_pdf(args.code_id, args.qr_number)
+    result = generator.embed_qr_in_pdf(args.code_id, args.qr_number, qr_mode=args.qr_mode)
     
     if result['success']:
         print(f"✅ Successfully generated PDF: {result['filename']}")
@@ -10,38 +10,75 @@ import sys
 import os
 import json
 from pathlib import Path
-from app import qr_manager, qr_codes_collection
+from qr_renderer import QRRenderEngine
+from pdf_imposition import write_print_pdf
+from scan_events import migrate_scan_history
+from qr_signing import QR_SIGNING_KEYS, generate_key, parse_keys
+from qr_stats import compute_stats
+from guest_import import GuestImportError, detect_format, read_guest_rows
 import base64
 
-def generate_qr_codes(count, output_dir="qr_codes", save_images=True, generate_pdfs=False):
+# app is imported inside each command: render and PDF worker processes re-run
+# this script's top level, and must not connect to MongoDB or create indexes
+
+def print_batch_report(report):
+    """Print the timing report of one generated chunk"""
+    print(
+        f"Chunk {report['chunk']}: {report['size']} codes from #{report['first_qr_number']} "
+        f"(render {report['render_seconds']:.2f}s, write {report['write_seconds']:.2f}s, "
+        f"{report['attempts']} attempt(s))"
+    )
+
+def generate_qr_codes(count, output_dir="qr_codes", save_images=True, generate_pdfs=False, batch_size=None, workers=None,
+                      image_format="png", pdf_qr_mode=None):
     """Generate bulk QR codes and optionally save images and PDFs"""
+    from app import qr_manager
     print(f"Generating {count} QR codes...")
     
+    if workers is not None:
+        qr_manager.render_engine = QRRenderEngine(workers=workers)
+    
     try:
-        codes = qr_manager.generate_bulk_qr_codes(count, generate_pdfs)
-        
         if save_images:
             # Create output directory
             output_path = Path(output_dir)
             output_path.mkdir(exist_ok=True)
+        
+        # Codes arrive chunk by chunk; only their metadata is kept, images go
+        # straight to disk
+        codes = []
+        for code in qr_manager.iter_bulk_qr_codes(
+            count,
+            generate_pdfs,
+            batch_size=batch_size,
+            progress_callback=print_batch_report,
+            include_images=save_images,
+            image_format=image_format,
+            pdf_qr_mode=pdf_qr_mode
+        ):
+            image = code.pop('qr_image_svg' if image_format == 'svg' else 'qr_image_base64', None)
+            codes.append(code)
             
-            # Save individual QR code images
-            for code in codes:
+            if save_images:
                 qr_number = code['qr_number']
                 code_id = code['code_id']
                 
-                # Decode base64 image
-                img_data = base64.b64decode(code['qr_image_base64'])
+                # Decode base64 image, SVG markup is saved as-is
+                if image_format == 'svg':
+                    img_data = image.encode()
+                else:
+                    img_data = base64.b64decode(image)
                 
                 # Save image file
-                img_filename = f"qr_{qr_number:03d}_{code_id[:8]}.png"
+                img_filename = f"qr_{qr_number:03d}_{code_id[:8]}.{image_format}"
                 img_path = output_path / img_filename
                 
                 with open(img_path, 'wb') as f:
                     f.write(img_data)
                 
                 print(f"Saved: {img_filename}")
-            
+        
+        if save_images:
             # Save codes metadata as JSON
             metadata_path = output_path / "codes_metadata.json"
             metadata = {
@@ -80,33 +117,53 @@ def generate_qr_codes(count, output_dir="qr_codes", save_images=True, generate_p
 
 def print_qr_stats():
     """Print current QR code statistics"""
+    from app import qr_codes_collection, scan_events_collection, stats_counters
     try:
-        total_codes = qr_codes_collection.count_documents({})
-        initialized_codes = qr_codes_collection.count_documents({"name": {"$ne": None}})
-        used_codes = qr_codes_collection.count_documents({"scan_count": {"$gt": 0}})
-        max_used_codes = qr_codes_collection.count_documents({"scan_count": {"$gte": 2}})
+        stats = compute_stats(qr_codes_collection, scan_events_collection, stats_counters)
+        arrivals = stats["arrival_rate"]
         
         print("=== QR Code Statistics ===")
-        print(f"Total codes: {total_codes}")
-        print(f"Initialized codes: {initialized_codes}")
-        print(f"Used codes: {used_codes}")
-        print(f"Fully used codes (2+ scans): {max_used_codes}")
-        print(f"Unused codes: {total_codes - used_codes}")
+        print(f"Total codes: {stats['total_codes']}")
+        print(f"Initialized codes: {stats['initialized_codes']}")
+        print(f"Used codes: {stats['used_codes']}")
+        print(f"Fully used codes (all scans used): {stats['max_used_codes']}")
+        print(f"Unused codes: {stats['unused_codes']}")
+        print(f"Total scans: {stats['total_scans']}")
+        print(f"Remaining scans: {stats['remaining_scans']} ({stats['capacity_used_percent']}% of capacity used)")
+        print(f"Arrivals: {arrivals['arrivals']} in the last {arrivals['window_minutes']} min ({arrivals['per_minute']}/min)")
+        for bucket in stats["max_scans_buckets"]:
+            print(f"  max_scans {bucket['max_scans']}: {bucket['codes']} codes, {bucket['initialized']} initialized, "
+                  f"{bucket['scans']} scans, {bucket['fully_used']} fully used")
         
-        return {
-            "total_codes": total_codes,
-            "initialized_codes": initialized_codes,
-            "used_codes": used_codes,
-            "max_used_codes": max_used_codes,
-            "unused_codes": total_codes - used_codes
-        }
+        return stats
         
     except Exception as e:
         print(f"Error fetching statistics: {e}")
         sys.exit(1)
 
+def recount_stats():
+    """Rebuild the stats counters from the tickets and report how far they had drifted"""
+    from app import stats_counters
+    try:
+        result = stats_counters.recount()
+        if result["drift"] is None:
+            print("Stats counters built (there were no counters to compare)")
+        elif not result["drift"]:
+            print("✅ Stats counters were accurate")
+        else:
+            print("⚠️  Stats counters had drifted (stored - actual):")
+            for bucket in result["drift"]:
+                fields = ", ".join(f"{field} {value:+d}" for field, value in bucket.items() if field != "max_scans")
+                print(f"  max_scans {bucket['max_scans']}: {fields}")
+            print("Counters rebuilt")
+        return result
+    except Exception as e:
+        print(f"Error recounting statistics: {e}")
+        sys.exit(1)
+
 def export_codes_list(output_file="codes_list.json"):
     """Export all QR codes to a JSON file"""
+    from app import qr_codes_collection
     try:
         codes = list(qr_codes_collection.find({}, {
             "_id": 0,
@@ -132,13 +189,169 @@ def export_codes_list(output_file="codes_list.json"):
         print(f"Error exporting codes: {e}")
         sys.exit(1)
 
+def refresh_pdfs(qr_mode=None, force=False, workers=None, batch_size=None, first=None, last=None):
+    """Generate PDF invitations that are missing or stale, skipping the current ones"""
+    from app import qr_manager
+    query = {}
+    if first is not None or last is not None:
+        query["qr_number"] = {}
+        if first is not None:
+            query["qr_number"]["$gte"] = first
+        if last is not None:
+            query["qr_number"]["$lte"] = last
+    
+    counts = {"skipped": 0, "generated": 0, "failed": 0}
+    try:
+        print("Checking PDF invitations...")
+        for record in qr_manager.iter_refresh_pdfs(query, qr_mode=qr_mode, force=force, workers=workers, batch_size=batch_size):
+            counts[record["status"]] += 1
+            if record["status"] == "generated":
+                print(f"Generated: {Path(record['file_path']).name}")
+            elif record["status"] == "failed":
+                print(f"Failed #{record['qr_number']}: {record['error']}")
+    except Exception as e:
+        print(f"Error generating PDFs: {e}")
+        sys.exit(1)
+    
+    print("\n📄 PDF Refresh Summary:")
+    print(f"   ⏭️  Up to date: {counts['skipped']}")
+    print(f"   ✅ Generated: {counts['generated']}")
+    print(f"   ❌ Failed: {counts['failed']}")
+    return counts
+
+def print_invitations_pdf(output_file="invitations_print.pdf", n_up=1, sheet=None, pages=None, qr_mode=None,
+                          first=None, last=None):
+    """Write every invitation into one print-ready PDF, in qr_number order"""
+    from app import qr_codes_collection, pdf_qr_generator
+    query = {}
+    if first is not None or last is not None:
+        query["qr_number"] = {}
+        if first is not None:
+            query["qr_number"]["$gte"] = first
+        if last is not None:
+            query["qr_number"]["$lte"] = last
+
+    total = qr_codes_collection.count_documents(query)
+    if not total:
+        print("No QR codes to print")
+        return None
+
+    def on_progress(done, code_data):
+        if done % 100 == 0 or done == total:
+            print(f"  {done}/{total} invitations written")
+
+    try:
+        codes = qr_codes_collection.find(query, {"_id": 0, "code_id": 1, "qr_number": 1}).sort("qr_number", 1)
+        print(f"Writing {total} invitations to {output_file} ({n_up}-up)...")
+        result = write_print_pdf(
+            pdf_qr_generator, codes, output_file,
+            n_up=n_up, sheet=sheet, pages=pages, qr_mode=qr_mode, progress_callback=on_progress
+        )
+    except Exception as e:
+        print(f"Error writing print PDF: {e}")
+        sys.exit(1)
+
+    if not result["success"]:
+        print(f"Error writing print PDF: {result['error']}")
+        sys.exit(1)
+
+    print(f"Wrote {result['sheets']} sheets ({result['size_bytes'] / 1024 / 1024:.1f} MB) to {result['file_path']}")
+    return result
+
+def manage_indexes(check_only=False):
+    """Create the required indexes and report query plans"""
+    from app import index_manager
+    try:
+        if not check_only:
+            print("=== Creating Indexes ===")
+            for index in index_manager.ensure():
+                status = "✅" if index["status"] == "ok" else f"❌ {index['error']}"
+                print(f"{index['collection']}.{index['name']}: {status}")
+            print()
+        
+        print("=== Existing Indexes ===")
+        for collection_name, names in index_manager.list_indexes().items():
+            print(f"{collection_name}: {', '.join(names)}")
+        
+        print("\n=== Query Plans ===")
+        plans = index_manager.check_query_plans()
+        for plan in plans:
+            if plan.get("error"):
+                print(f"⚠️  {plan['query']}: could not explain ({plan['error']})")
+            elif plan["collscan"]:
+                print(f"❌ {plan['query']}: COLLSCAN ({' <- '.join(plan['stages'])})")
+            else:
+                print(f"✅ {plan['query']}: {' <- '.join(plan['stages'])}")
+        return plans
+    except Exception as e:
+        print(f"Error managing indexes: {e}")
+        sys.exit(1)
+
+def migrate_scans():
+    """Move legacy scan_history arrays into the scan_events collection"""
+    from app import qr_codes_collection, scan_event_log
+    try:
+        result = migrate_scan_history(qr_codes_collection, scan_event_log)
+        print(f"Moved {result['events']} scans from {result['tickets']} tickets to scan_events")
+        return result
+    except Exception as e:
+        print(f"Error migrating scan history: {e}")
+        sys.exit(1)
+
+def import_guests(guest_file, dry_run=False, batch_size=None):
+    """Pre-assign guest names to codes from a CSV or JSON guest list"""
+    from app import qr_manager
+    try:
+        with open(guest_file, newline='', encoding='utf-8-sig') as f:
+            result = qr_manager.initialize_bulk(
+                read_guest_rows(f, detect_format(guest_file)),
+                dry_run=dry_run,
+                batch_size=batch_size
+            )
+    except (OSError, GuestImportError, ValueError) as e:
+        print(f"Error importing guests: {e}")
+        sys.exit(1)
+    
+    for row in result["results"]:
+        if row["status"] == "rejected":
+            code = row["code_id"] or f"#{row['qr_number']}"
+            print(f"❌ Row {row['row']} ({code}, {row['name']}): {row['error']}")
+    
+    counts = result["counts"]
+    if dry_run:
+        print(f"🔍 Dry run: {counts.get('valid', 0)} of {result['total']} rows can be imported, nothing was written")
+    else:
+        print(f"✅ Initialized {counts.get('initialized', 0)} of {result['total']} guests")
+    print(f"⏱️  {result['seconds']}s ({result['rows_per_second']} rows/s)")
+    return result
+
+def new_signing_key(key_id):
+    """Print a new QR signing key and the QR_SIGNING_KEYS value that rotates it in"""
+    try:
+        current = parse_keys(QR_SIGNING_KEYS)
+        if key_id in current:
+            print(f"Key id '{key_id}' is already in QR_SIGNING_KEYS")
+            sys.exit(1)
+        entry = generate_key(key_id)
+        print(f"🔑 New signing key: {entry}")
+        print("Put it first in QR_SIGNING_KEYS and keep the old keys while their codes are in circulation:")
+        print(f"QR_SIGNING_KEYS={','.join([entry] + [f'{kid}:{secret.decode()}' for kid, secret in current.items()])}")
+        if current:
+            print("QR URLs are signed with the new key from then on; 'pdfs' regenerates the invitation PDFs")
+        return entry
+    except ValueError as e:
+        print(f"Error creating signing key: {e}")
+        sys.exit(1)
+
 def clear_all_codes():
     """Clear all QR codes from database (use with caution!)"""
+    from app import qr_codes_collection, stats_counters
     response = input("Are you sure you want to delete ALL QR codes? This cannot be undone. (yes/no): ")
     
     if response.lower() == 'yes':
         try:
             result = qr_codes_collection.delete_many({})
+            stats_counters.recount()
             print(f"Deleted {result.deleted_count} QR codes")
         except Exception as e:
             print(f"Error clearing codes: {e}")
@@ -158,6 +371,9 @@ Examples:
   # Generate codes with PDF invitations
   python qr_generator.py generate --count 50 --generate-pdfs
 
+  # Save SVG images and use a raster QR in the PDFs
+  python qr_generator.py generate --count 50 --format svg --generate-pdfs --pdf-qr raster
+
   # Generate codes without saving images
   python qr_generator.py generate --count 50 --no-images
 
@@ -167,6 +383,28 @@ Examples:
   # Show statistics
   python qr_generator.py stats
 
+  # Rebuild the stats counters and report drift
+  python qr_generator.py recount
+
+  # Generate only missing or outdated PDF invitations (safe to re-run after a crash)
+  python qr_generator.py pdfs
+
+  # One print-ready PDF of every invitation, 4 per A3 sheet
+  python qr_generator.py print-pdf --n-up 4 --sheet A3 --output print_run.pdf
+
+  # Create the MongoDB indexes and check the query plans
+  python qr_generator.py indexes
+
+  # Move scan_history arrays left by older versions to scan_events
+  python qr_generator.py migrate-scans
+
+  # Check a guest list, then pre-assign its names to the codes
+  python qr_generator.py import-guests guests.csv --dry-run
+  python qr_generator.py import-guests guests.csv
+
+  # Create a QR signing key (rotation: the new key goes first in QR_SIGNING_KEYS)
+  python qr_generator.py signing-key --key-id k2
+
   # Export all codes to JSON
   python qr_generator.py export --output codes_backup.json
 
@@ -183,14 +421,57 @@ Examples:
     gen_parser.add_argument('--output-dir', default='qr_codes', help='Output directory for images (default: qr_codes)')
     gen_parser.add_argument('--no-images', action='store_true', help="Don't save QR code images")
     gen_parser.add_argument('--generate-pdfs', action='store_true', help='Generate PDF invitations with embedded QR codes')
+    gen_parser.add_argument('--format', choices=['png', 'svg'], default='png', help='Image format for saved QR codes (default: png)')
+    gen_parser.add_argument('--pdf-qr', choices=['vector', 'raster'], help='Draw PDF QR codes as vector rectangles or a 1-bit image (default: QR_PDF_MODE)')
+    gen_parser.add_argument('--workers', type=int, help='QR render processes (default: QR_RENDER_WORKERS or one per core, 1 = serial)')
+    gen_parser.add_argument('--batch-size', type=int, help='Codes written to MongoDB per insert_many (default: GENERATION_BATCH_SIZE or 500)')
     
     # Stats command
     subparsers.add_parser('stats', help='Show QR code statistics')
     
+    # Recount command
+    subparsers.add_parser('recount', help='Rebuild the stats counters from the tickets and report drift')
+    
     # Export command
     export_parser = subparsers.add_parser('export', help='Export all QR codes to JSON')
     export_parser.add_argument('--output', default='codes_list.json', help='Output JSON file (default: codes_list.json)')
     
+    # PDFs command
+    pdfs_parser = subparsers.add_parser('pdfs', help='Generate missing or outdated PDF invitations')
+    pdfs_parser.add_argument('--force', action='store_true', help='Regenerate every PDF, even up-to-date ones')
+    pdfs_parser.add_argument('--pdf-qr', choices=['vector', 'raster'], help='Draw PDF QR codes as vector rectangles or a 1-bit image (default: QR_PDF_MODE)')
+    pdfs_parser.add_argument('--workers', type=int, help='PDF worker processes (default: PDF_WORKERS or one per core, 1 = in-process)')
+    pdfs_parser.add_argument('--batch-size', type=int, help='Results recorded in MongoDB per bulk_write (default: GENERATION_BATCH_SIZE or 500)')
+    pdfs_parser.add_argument('--first', type=int, help='First qr_number to include')
+    pdfs_parser.add_argument('--last', type=int, help='Last qr_number to include')
+    
+    # Print PDF command
+    print_parser = subparsers.add_parser('print-pdf', help='Write all invitations into one print-ready PDF')
+    print_parser.add_argument('--output', default='invitations_print.pdf', help='Output PDF file (default: invitations_print.pdf)')
+    print_parser.add_argument('--n-up', type=int, default=1, help='Invitation pages per sheet (default: 1)')
+    print_parser.add_argument('--sheet', help='Sheet size: A4, A3, SRA3, letter, tabloid or WIDTHxHEIGHT in points (default: template size, A3 when imposing)')
+    print_parser.add_argument('--pages', help='Template pages to print per invitation, e.g. 2 or 1,2 (default: all)')
+    print_parser.add_argument('--pdf-qr', choices=['vector', 'raster'], help='Draw QR codes as vector rectangles or a 1-bit image (default: QR_PDF_MODE)')
+    print_parser.add_argument('--first', type=int, help='First qr_number to include')
+    print_parser.add_argument('--last', type=int, help='Last qr_number to include')
+    
+    # Indexes command
+    indexes_parser = subparsers.add_parser('indexes', help='Create required MongoDB indexes and check query plans')
+    indexes_parser.add_argument('--check-only', action='store_true', help="Only report indexes and query plans, don't create anything")
+    
+    # Migrate scans command
+    subparsers.add_parser('migrate-scans', help='Move scan_history arrays from tickets to scan_events')
+    
+    # Import guests command
+    import_parser = subparsers.add_parser('import-guests', help='Pre-assign guest names from a CSV or JSON guest list')
+    import_parser.add_argument('guest_file', help='CSV with a header row (code_id or qr_number, name, max_scans) or JSON list of the same')
+    import_parser.add_argument('--dry-run', action='store_true', help='Validate every row without writing anything')
+    import_parser.add_argument('--batch-size', type=int, help='Rows written per bulk_write (default: INIT_BULK_BATCH or 1000)')
+    
+    # Signing key command
+    signing_parser = subparsers.add_parser('signing-key', help='Create a key for signing QR URLs')
+    signing_parser.add_argument('--key-id', default='k1', help='Short alphanumeric key id embedded in signatures (default: k1)')
+    
     # Clear command
     subparsers.add_parser('clear', help='Clear all QR codes (DANGER!)')
     
@@ -206,12 +487,45 @@ Examples:
             count=args.count,
             output_dir=args.output_dir,
             save_images=not args.no_images,
-            generate_pdfs=args.generate_pdfs
+            generate_pdfs=args.generate_pdfs,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            image_format=args.format,
+            pdf_qr_mode=args.pdf_qr
         )
     elif args.command == 'stats':
         print_qr_stats()
+    elif args.command == 'recount':
+        recount_stats()
     elif args.command == 'export':
         export_codes_list(args.output)
+    elif args.command == 'pdfs':
+        refresh_pdfs(
+            qr_mode=args.pdf_qr,
+            force=args.force,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            first=args.first,
+            last=args.last
+        )
+    elif args.command == 'print-pdf':
+        print_invitations_pdf(
+            output_file=args.output,
+            n_up=args.n_up,
+            sheet=args.sheet,
+            pages=[int(page) - 1 for page in args.pages.split(',')] if args.pages else None,
+            qr_mode=args.pdf_qr,
+            first=args.first,
+            last=args.last
+        )
+    elif args.command == 'indexes':
+        manage_indexes(check_only=args.check_only)
+    elif args.command == 'migrate-scans':
+        migrate_scans()
+    elif args.command == 'import-guests':
+        import_guests(args.guest_file, dry_run=args.dry_run, batch_size=args.batch_size)
+    elif args.command == 'signing-key':
+        new_signing_key(args.key_id)
     elif args.command == 'clear':
         clear_all_codes()
 
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+QR Code Rendering Engine for Wedding Guest Verification System
+
+This module renders QR code images for batches of code IDs. Large batches are
+spread over a process pool so bulk generation uses every core, while small
+batches (or hosts where a pool cannot be started) render serially. Single
+images for the on-demand endpoints go through a bounded LRU cache.
+
+Rasterizing scales the QR module matrix straight to the target pixel size
+with NumPy, so no oversized image is drawn and resampled per code.
+"""
+
+import os
+import math
+import base64
+import logging
+import hashlib
+import multiprocessing
+from io import BytesIO
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import qrcode
+from PIL import Image
+from qr_signing import qr_signer
+
+logger = logging.getLogger(__name__)
+
+# Number of render processes; 0 means one per CPU core, 1 disables the pool
+QR_RENDER_WORKERS = int(os.environ.get('QR_RENDER_WORKERS', 0))
+
+# Batches smaller than this are rendered in-process, the pool overhead isn't worth it
+QR_RENDER_MIN_PARALLEL = int(os.environ.get('QR_RENDER_MIN_PARALLEL', 64))
+
+# Rendered images kept by the on-demand image endpoints (per process)
+QR_IMAGE_CACHE_SIZE = int(os.environ.get('QR_IMAGE_CACHE_SIZE', 4096))
+
+# Shared QR settings; the API, the CLI and the PDF invitations all render through
+# them, so the same code gives byte-identical images everywhere
+QR_IMAGE_SIZE = int(os.environ.get('QR_IMAGE_SIZE', 360))
+QR_BORDER = 4
+QR_ERROR_CORRECTION = qrcode.constants.ERROR_CORRECT_M
+
+# Palette index 0 is the light background, index 1 a dark module
+QR_PALETTE = [255, 255, 255, 0, 0, 0]
+
+IMAGE_MIMETYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml'
+}
+
+def build_qr_url(base_url, code_id):
+    """Build the URL encoded in a guest's QR code, signed when signing keys are set"""
+    return f"{base_url}/init?{qr_signer.url_query(code_id)}"
+
+def build_qr_image_url(code_id, image_format='png'):
+    """
+    Path of a code's on-demand QR image
+
+    With signing enabled the image depends on the active key, so the path
+    names it (``?k=<key id>``): rotating the key changes the URL instead of
+    leaving long-cached images with the old signature.
+    """
+    path = f"/api/code/{code_id}/qr.{image_format}"
+    if qr_signer.enabled:
+        return f"{path}?k={qr_signer.active_key_id}"
+    return path
+
+def make_qr(qr_url):
+    """Encode a URL with the shared QR settings"""
+    qr = qrcode.QRCode(version=1, error_correction=QR_ERROR_CORRECTION, border=QR_BORDER)
+    qr.add_data(qr_url)
+    qr.make(fit=True)
+    return qr
+
+def qr_matrix(qr_url):
+    """Get the module matrix of a QR code, quiet zone included, as a boolean array"""
+    return np.array(make_qr(qr_url).get_matrix(), dtype=bool)
+
+def rasterize(matrix, size_px=None):
+    """
+    Scale a module matrix to exactly ``size_px`` square pixels
+
+    Each output pixel takes the module it falls in (nearest neighbour), so
+    nothing is drawn larger and resampled afterwards. Returns a uint8 array
+    with 1 for dark pixels.
+    """
+    size_px = size_px or QR_IMAGE_SIZE
+    index = np.arange(size_px) * matrix.shape[0] // size_px
+    return matrix[np.ix_(index, index)].astype(np.uint8)
+
+def pixels_to_image(pixels):
+    """Wrap a rasterized uint8 array in a two-colour palette PIL image"""
+    img = Image.frombytes('P', (pixels.shape[1], pixels.shape[0]), pixels.tobytes())
+    img.putpalette(QR_PALETTE)
+    return img
+
+def render_qr_pil(qr_url, size_px=None):
+    """Render a QR code as a 1-bit palette PIL image of exactly ``size_px`` pixels"""
+    return pixels_to_image(rasterize(qr_matrix(qr_url), size_px))
+
+def render_qr_png(qr_url, size_px=None):
+    """Render a QR code for the given URL as 1-bit palette PNG bytes"""
+    buffer = BytesIO()
+    render_qr_pil(qr_url, size_px).save(buffer, format='PNG', bits=1)
+    return buffer.getvalue()
+
+def iter_module_runs(matrix):
+    """
+    Yield the dark modules of a matrix as horizontal runs
+
+    Returns:
+        generator: (row, first column, length) for each run of dark modules
+    """
+    for row, modules in enumerate(matrix):
+        # Run boundaries are where the padded row flips between light and dark
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], modules.astype(np.int8), [0]))))
+        for start, stop in zip(edges[::2], edges[1::2]):
+            yield row, int(start), int(stop - start)
+
+def render_qr_svg(qr_url, size_px=None):
+    """Render a QR code for the given URL as SVG bytes, one path in module units"""
+    matrix = qr_matrix(qr_url)
+    size_px = size_px or QR_IMAGE_SIZE
+    modules = matrix.shape[0]
+    path = "".join(f"M{col} {row}h{length}v1h-{length}z" for row, col, length in iter_module_runs(matrix))
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size_px}" height="{size_px}" '
+        f'viewBox="0 0 {modules} {modules}" shape-rendering="crispEdges">'
+        f'<rect width="{modules}" height="{modules}" fill="#fff"/>'
+        f'<path d="{path}" fill="#000"/></svg>'
+    ).encode()
+
+@lru_cache(maxsize=QR_IMAGE_CACHE_SIZE)
+def render_qr_image(qr_url, image_format='png'):
+    """
+    Render a QR code on demand through a bounded LRU cache
+
+    Returns:
+        tuple: (image bytes, strong ETag derived from the bytes)
+    """
+    if image_format == 'svg':
+        data = render_qr_svg(qr_url)
+    else:
+        data = render_qr_png(qr_url)
+    return data, hashlib.sha256(data).hexdigest()[:32]
+
+def render_qr_base64(qr_url):
+    """Render a QR code for the given URL as a base64 encoded PNG"""
+    return base64.b64encode(render_qr_png(qr_url)).decode()
+
+def render_qr_inline(qr_url, image_format='png'):
+    """Render a QR code for a JSON payload: base64 PNG or SVG markup"""
+    if image_format == 'svg':
+        return render_qr_svg(qr_url).decode()
+    return render_qr_base64(qr_url)
+
+def _render_chunk(qr_urls, image_format='png'):
+    """Pool task: render a slice of a batch (module level so it can be pickled)"""
+    return [render_qr_inline(qr_url, image_format) for qr_url in qr_urls]
+
+class RenderBatch:
+    """Handle for a batch of QR images that may still be rendering"""
+
+    def __init__(self, engine, qr_urls, image_format='png', futures=None, images=None):
+        self._engine = engine
+        self._qr_urls = qr_urls
+        self._image_format = image_format
+        self._futures = futures
+        self._images = images
+
+    def result(self):
+        """Wait for the batch and return the rendered images in input order"""
+        if self._images is None:
+            try:
+                images = []
+                for future in self._futures:
+                    images.extend(future.result())
+                self._images = images
+            except (BrokenProcessPool, OSError) as e:
+                self._engine._disable_pool(e)
+                self._images = _render_chunk(self._qr_urls, self._image_format)
+            self._futures = None
+        return self._images
+
+class QRRenderEngine:
+    """
+    Renders QR images for batches of URLs across a process pool
+
+    The pool is created lazily with the ``spawn`` start method, so forked web
+    workers never inherit MongoDB client threads. If the pool cannot be started
+    or breaks, the engine falls back to serial rendering for the rest of the
+    process lifetime.
+    """
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = QR_RENDER_WORKERS
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self._pool = None
+        self._pool_disabled = self.workers <= 1
+
+    @property
+    def parallel(self):
+        """Whether batches are currently rendered on the process pool"""
+        return not self._pool_disabled
+
+    def submit(self, qr_urls, image_format='png'):
+        """
+        Start rendering a batch of QR URLs
+
+        Returns:
+            RenderBatch: call ``result()`` to get the images in input order,
+            base64 PNGs or SVG markup depending on ``image_format``
+        """
+        qr_urls = list(qr_urls)
+        if self._pool_disabled or len(qr_urls) < QR_RENDER_MIN_PARALLEL:
+            return RenderBatch(self, qr_urls, image_format, images=_render_chunk(qr_urls, image_format))
+
+        try:
+            pool = self._get_pool()
+            # A few slices per worker keeps cores busy without per-code IPC
+            slice_size = math.ceil(len(qr_urls) / (self.workers * 4))
+            futures = [
+                pool.submit(_render_chunk, qr_urls[i:i + slice_size], image_format)
+                for i in range(0, len(qr_urls), slice_size)
+            ]
+            return RenderBatch(self, qr_urls, image_format, futures=futures)
+        except (BrokenProcessPool, OSError, RuntimeError) as e:
+            self._disable_pool(e)
+            return RenderBatch(self, qr_urls, image_format, images=_render_chunk(qr_urls, image_format))
+
+    def render_batch(self, qr_urls, image_format='png'):
+        """Render a batch of QR URLs and return the images in input order"""
+        return self.submit(qr_urls, image_format).result()
+
+    def shutdown(self):
+        """Stop the worker processes, if any were started"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._pool
+
+    def _disable_pool(self, error):
+        logger.warning("QR render pool unavailable (%s); falling back to serial rendering", error)
+        self._pool_disabled = True
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+QR Code Signing for Wedding Guest Verification System
+
+QR URLs carry a short HMAC over the code_id (``&sig=<key id>.<mac>``), so scan
+and init can reject misreads, foreign QR codes and guessed IDs in-process,
+without a MongoDB lookup.
+
+Keys are listed in QR_SIGNING_KEYS as ``<key id>:<secret>`` pairs, newest
+first. New codes are signed with the first key; every listed key still
+verifies, so a key is rotated by putting a new one in front and dropping the
+old one once no printed code uses it. Codes printed before signing was
+enabled have no signature and are accepted in ``compat`` mode.
+"""
+
+import os
+import hmac
+import base64
+import hashlib
+import secrets
+
+# Signing keys, newest first: "k2:secret2,k1:secret1"
+QR_SIGNING_KEYS = os.environ.get('QR_SIGNING_KEYS', '')
+
+# 'compat' accepts unsigned (already printed) codes, 'strict' rejects them,
+# 'off' neither signs nor verifies. Without keys signing is always off.
+QR_SIGNATURE_MODE = os.environ.get('QR_SIGNATURE_MODE', 'compat')
+
+# Characters of the base64url MAC kept in the URL (16 chars = 96 bits)
+QR_SIGNATURE_LENGTH = 16
+
+def parse_keys(value):
+    """Parse 'kid:secret,...' into an ordered {key id: secret bytes} dict"""
+    keys = {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        key_id, separator, secret = item.partition(':')
+        if not separator or not key_id.isalnum() or not secret:
+            raise ValueError(f"Invalid QR signing key entry: {key_id or item[:8]}...")
+        keys[key_id] = secret.encode()
+    return keys
+
+def generate_key(key_id):
+    """Create a new 'kid:secret' entry for QR_SIGNING_KEYS"""
+    return f"{key_id}:{secrets.token_urlsafe(32)}"
+
+class QRSigner:
+    """Signs code IDs and verifies signatures against the configured keys"""
+
+    def __init__(self, keys=None, mode=None):
+        self.keys = parse_keys(QR_SIGNING_KEYS) if keys is None else keys
+        self.mode = mode or QR_SIGNATURE_MODE
+        if self.mode not in ('off', 'compat', 'strict'):
+            raise ValueError(f"Unknown QR signature mode: {self.mode}")
+        self.active_key_id = next(iter(self.keys), None)
+
+    @property
+    def enabled(self):
+        """Whether new codes are signed and signatures checked"""
+        return self.mode != 'off' and self.active_key_id is not None
+
+    def sign(self, code_id):
+        """Signature for a code_id with the active key, '<key id>.<mac>'"""
+        return f"{self.active_key_id}.{self._mac(self.active_key_id, code_id)}"
+
+    def verify(self, code_id, signature):
+        """
+        Check a code's signature
+
+        Returns:
+            str: 'valid', 'unsigned' (no signature given) or 'invalid'
+        """
+        if not signature:
+            return 'unsigned'
+        key_id, _, mac = str(signature).partition('.')
+        # compare_digest raises TypeError on non-ASCII text; a real MAC is base64url
+        if key_id not in self.keys or not mac or not mac.isascii():
+            return 'invalid'
+        if hmac.compare_digest(mac, self._mac(key_id, code_id)):
+            return 'valid'
+        return 'invalid'
+
+    def accepts(self, code_id, signature):
+        """Whether a scanned code may go on to the database"""
+        if not self.enabled:
+            return True
+        outcome = self.verify(code_id, signature)
+        return outcome == 'valid' or (outcome == 'unsigned' and self.mode == 'compat')
+
+    def url_query(self, code_id):
+        """Query string for a code's QR URL"""
+        if self.enabled:
+            return f"code={code_id}&sig={self.sign(code_id)}"
+        return f"code={code_id}"
+
+    def _mac(self, key_id, code_id):
+        digest = hmac.new(self.keys[key_id], str(code_id).encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).decode()[:QR_SIGNATURE_LENGTH]
+
+# Process-wide signer built from the environment
+qr_signer = QRSigner()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+QR Code Statistics for Wedding Guest Verification System
+
+Computes the figures shown by ``/api/stats`` and ``qr_generator.py stats``.
+The ticket counters per max_scans value are read from a materialized
+counters document (StatsCounters), or computed by one aggregation that
+groups the codes by their max_scans when there is none yet. The arrival
+rate comes from an indexed range count on scan_events, reused for
+STATS_ARRIVAL_CACHE_SECONDS so a stats read is normally one point lookup.
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Minutes of accepted scans the arrival rate is averaged over
+STATS_ARRIVAL_WINDOW = int(os.environ.get('STATS_ARRIVAL_WINDOW', 15))
+
+# Seconds a computed arrival rate is reused by compute_stats
+STATS_ARRIVAL_CACHE_SECONDS = float(os.environ.get('STATS_ARRIVAL_CACHE_SECONDS', 10))
+
+# Seconds between writes of the counter changes collected in a process
+STATS_FLUSH_SECONDS = float(os.environ.get('STATS_FLUSH_SECONDS', 1))
+
+# Scans allowed per ticket when a code has no max_scans of its own
+DEFAULT_MAX_SCANS = 2
+
+_MAX_SCANS = {"$ifNull": ["$max_scans", DEFAULT_MAX_SCANS]}
+_SCAN_COUNT = {"$ifNull": ["$scan_count", 0]}
+_INITIALIZED = {"$ne": [{"$ifNull": ["$name", ""]}, ""]}
+
+def _count_if(condition):
+    return {"$sum": {"$cond": [condition, 1, 0]}}
+
+# One group per max_scans value; the totals are summed from the groups
+STATS_PIPELINE = [
+    {"$project": {"_id": 0, "name": 1, "scan_count": 1, "max_scans": 1}},
+    {"$group": {
+        "_id": _MAX_SCANS,
+        "codes": {"$sum": 1},
+        "initialized": _count_if(_INITIALIZED),
+        "used": _count_if({"$gt": [_SCAN_COUNT, 0]}),
+        "fully_used": _count_if({"$gte": [_SCAN_COUNT, _MAX_SCANS]}),
+        "scans": {"$sum": _SCAN_COUNT},
+        "remaining_scans": {"$sum": {"$cond": [
+            _INITIALIZED,
+            {"$max": [{"$subtract": [_MAX_SCANS, _SCAN_COUNT]}, 0]},
+            0
+        ]}}
+    }},
+    {"$sort": {"_id": 1}}
+]
+
+def bucket_stats(codes_collection):
+    """Ticket counters per max_scans value, from STATS_PIPELINE"""
+    return [
+        {
+            "max_scans": group["_id"],
+            "codes": group["codes"],
+            "initialized": group["initialized"],
+            "used": group["used"],
+            "fully_used": group["fully_used"],
+            "scans": group["scans"],
+            "remaining_scans": group["remaining_scans"]
+        }
+        for group in codes_collection.aggregate(STATS_PIPELINE)
+    ]
+
+def arrival_rate(scan_events_collection, now=None, window_minutes=None):
+    """Accepted scans in the last ``window_minutes`` and their rate per minute"""
+    now = now or datetime.utcnow()
+    window_minutes = window_minutes or STATS_ARRIVAL_WINDOW
+    arrivals = scan_events_collection.count_documents({
+        "ts": {"$gte": now - timedelta(minutes=window_minutes)},
+        "result": "valid"
+    })
+    return {
+        "window_minutes": window_minutes,
+        "arrivals": arrivals,
+        "per_minute": round(arrivals / window_minutes, 2)
+    }
+
+# Last arrival rate per scan_events collection and window: (computed at, rate)
+_arrival_cache = {}
+
+def cached_arrival_rate(scan_events_collection, window_minutes=None):
+    """arrival_rate, recomputed at most every STATS_ARRIVAL_CACHE_SECONDS"""
+    key = (scan_events_collection.full_name, window_minutes or STATS_ARRIVAL_WINDOW)
+    cached = _arrival_cache.get(key)
+    if cached and time.monotonic() - cached[0] < STATS_ARRIVAL_CACHE_SECONDS:
+        return cached[1]
+    rate = arrival_rate(scan_events_collection, window_minutes=window_minutes)
+    _arrival_cache[key] = (time.monotonic(), rate)
+    return rate
+
+def summarize(buckets):
+    """Totals and derived figures from the per-max_scans counters"""
+    total = lambda field: sum(bucket[field] for bucket in buckets)
+    total_codes = total("codes")
+    initialized_codes = total("initialized")
+    used_codes = total("used")
+    total_scans = total("scans")
+    remaining_scans = total("remaining_scans")
+    return {
+        "total_codes": total_codes,
+        "initialized_codes": initialized_codes,
+        "used_codes": used_codes,
+        "max_used_codes": total("fully_used"),
+        "unused_codes": total_codes - used_codes,
+        "total_scans": total_scans,
+        # Scans the initialized guests can still make at the door
+        "remaining_scans": remaining_scans,
+        "capacity_used_percent": round(100 * total_scans / (total_scans + remaining_scans), 1) if total_scans + remaining_scans else 0.0,
+        "max_scans_buckets": buckets
+    }
+
+def compute_stats(codes_collection, scan_events_collection, counters=None, now=None):
+    """
+    Compute every statistic
+
+    With ``counters`` the ticket figures are a point lookup of the counters
+    document; the first call without trusted counters builds them. The
+    arrival rate is cached unless ``now`` is given.
+
+    Returns:
+        dict: total_codes, initialized_codes, used_codes, max_used_codes
+            (codes whose scans are all used), unused_codes, total_scans,
+            remaining_scans, capacity_used_percent, max_scans_buckets and
+            arrival_rate
+    """
+    buckets = counters.buckets() if counters else None
+    if buckets is None:
+        buckets = counters.recount()["buckets"] if counters else bucket_stats(codes_collection)
+    stats = summarize(buckets)
+    stats["arrival_rate"] = arrival_rate(scan_events_collection, now) if now else cached_arrival_rate(scan_events_collection)
+    return stats
+
+# Counter fields kept per max_scans bucket, as returned by bucket_stats
+COUNTER_FIELDS = ("codes", "initialized", "used", "fully_used", "scans", "remaining_scans")
+
+class StatsCounters:
+    """
+    Materialized ticket counters, so reading the stats is one point lookup
+
+    A single document holds the bucket_stats counters per max_scans value.
+    Code paths that change tickets add the matching changes after their
+    ticket write; each process sums them and writes one ``$inc`` every
+    STATS_FLUSH_SECONDS from a daemon thread (and at exit), so scans do not
+    wait on, or queue up behind, the shared document. The writes are not
+    one transaction with the tickets, so a crash leaves the counters
+    slightly off until ``recount``, which rebuilds them from STATS_PIPELINE
+    and reports the drift. Until the first recount the document is not
+    trusted and stats fall back to the aggregation.
+    """
+
+    DOC_ID = "qr_codes"
+
+    def __init__(self, collection, codes_collection):
+        self.collection = collection
+        self.codes_collection = codes_collection
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def add_codes(self, docs):
+        """Count newly inserted code documents"""
+        inc = {}
+        for doc in docs:
+            self._add(inc, doc.get("max_scans", DEFAULT_MAX_SCANS), codes=1)
+        self._apply(inc)
+
+    def add_initialized(self, changes):
+        """
+        Count initializations
+
+        Args:
+            changes: Iterable of (previous max_scans, new max_scans, scan_count)
+        """
+        inc = {}
+        for old_max, new_max, scan_count in changes:
+            if old_max != new_max:
+                # The code moves to the bucket of its new max_scans
+                self._add(inc, old_max, **self._code_fields(old_max, scan_count, -1))
+                self._add(inc, new_max, **self._code_fields(new_max, scan_count, 1))
+            self._add(inc, new_max, initialized=1, remaining_scans=max(new_max - scan_count, 0))
+        self._apply(inc)
+
+    def add_scans(self, changes):
+        """
+        Count accepted scans
+
+        Args:
+            changes: Iterable of (max_scans, scan_count before, scan_count after)
+        """
+        inc = {}
+        for max_scans, old, new in changes:
+            self._add(
+                inc, max_scans,
+                scans=new - old,
+                used=int(old == 0 < new),
+                fully_used=int(old < max_scans <= new),
+                remaining_scans=-max(min(new, max_scans) - min(old, max_scans), 0)
+            )
+        self._apply(inc)
+
+    def buckets(self):
+        """Counters per max_scans like bucket_stats, None until the first recount"""
+        doc = self.collection.find_one({"_id": self.DOC_ID})
+        if not doc or "counted_at" not in doc:
+            return None
+        return self._bucket_list(doc.get("buckets", {}))
+
+    def recount(self):
+        """
+        Rebuild the counters from the tickets themselves
+
+        Returns:
+            dict: The fresh buckets, and the drift per bucket and field of the
+                stored counters (stored minus actual; empty when they agree,
+                None when there were no trusted counters)
+        """
+        with self._flush_lock:
+            # Changes collected so far belong to ticket writes the recount sees
+            with self._lock:
+                self._pending = {}
+            stored = self.buckets()
+            fresh = bucket_stats(self.codes_collection)
+            now = datetime.utcnow()
+            self.collection.replace_one(
+                {"_id": self.DOC_ID},
+                {
+                    "buckets": {
+                        str(bucket["max_scans"]): {field: bucket[field] for field in COUNTER_FIELDS}
+                        for bucket in fresh
+                    },
+                    "counted_at": now,
+                    "updated_at": now
+                },
+                upsert=True
+            )
+
+        drift = None
+        if stored is not None:
+            drift = []
+            stored_by_max = {bucket["max_scans"]: bucket for bucket in stored}
+            fresh_by_max = {bucket["max_scans"]: bucket for bucket in fresh}
+            for max_scans in sorted(set(stored_by_max) | set(fresh_by_max)):
+                before = stored_by_max.get(max_scans, {})
+                after = fresh_by_max.get(max_scans, {})
+                fields = {
+                    field: before.get(field, 0) - after.get(field, 0)
+                    for field in COUNTER_FIELDS
+                    if before.get(field, 0) != after.get(field, 0)
+                }
+                if fields:
+                    drift.append({"max_scans": max_scans, **fields})
+        return {"buckets": fresh, "drift": drift}
+
+    def _code_fields(self, max_scans, scan_count, sign):
+        return {
+            "codes": sign,
+            "used": sign * int(scan_count > 0),
+            "fully_used": sign * int(scan_count >= max_scans),
+            "scans": sign * scan_count
+        }
+
+    def _add(self, inc, max_scans, **fields):
+        for field, value in fields.items():
+            if value:
+                key = f"buckets.{max_scans}.{field}"
+                inc[key] = inc.get(key, 0) + value
+
+    def flush(self):
+        """Write the changes collected in this process as one $inc"""
+        with self._flush_lock:
+            with self._lock:
+                inc, self._pending = self._pending, {}
+            inc = {key: value for key, value in inc.items() if value}
+            if not inc:
+                return
+            try:
+                self.collection.update_one(
+                    {"_id": self.DOC_ID},
+                    {"$inc": inc, "$set": {"updated_at": datetime.utcnow()}},
+                    upsert=True
+                )
+            except PyMongoError:
+                # Kept for the next flush; recount repairs anything lost
+                logger.exception("Could not update stats counters")
+                with self._lock:
+                    for key, value in inc.items():
+                        self._pending[key] = self._pending.get(key, 0) + value
+
+    def _apply(self, inc):
+        with self._lock:
+            for key, value in inc.items():
+                self._pending[key] = self._pending.get(key, 0) + value
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_forever, name="stats-counters", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(STATS_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Stats counter writer error")
+
+    def _bucket_list(self, buckets):
+        return [
+            dict({"max_scans": int(max_scans)}, **{field: counters.get(field, 0) for field in COUNTER_FIELDS})
+            for max_scans, counters in sorted(buckets.items(), key=lambda item: int(item[0]))
+            if any(counters.values())
+        ]
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Scan Event Log for Wedding Guest Verification System
+
+Every scan, accepted or rejected, is appended to the ``scan_events``
+collection as its own small document. Ticket documents only keep their
+counters, so they stay the same size however often they are scanned, and
+analytics query events through time-bucketed indexes instead of unwinding
+arrays across every ticket.
+
+This is a regular collection rather than a time-series one, so change
+streams can follow it.
+
+Scans queue their events in process and a background thread appends them
+with insert_many (write-behind), so recording an event adds no round trip
+to the scan.
+"""
+
+import os
+import atexit
+import logging
+import threading
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Seconds between write-behind flushes, and most events per insert_many
+SCAN_EVENT_FLUSH_SECONDS = float(os.environ.get('SCAN_EVENT_FLUSH_SECONDS', 0.5))
+SCAN_EVENT_BATCH = int(os.environ.get('SCAN_EVENT_BATCH', 500))
+
+# Events held while MongoDB is unreachable; new events are dropped beyond this
+SCAN_EVENT_QUEUE_MAX = int(os.environ.get('SCAN_EVENT_QUEUE_MAX', 100000))
+
+def hour_bucket(ts):
+    """Start of the hour a timestamp falls in"""
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+def scan_event(code_id, result, ts=None, device_id=None, source="api", event_id=None):
+    """
+    Build a scan event document from a scan result
+
+    Args:
+        result: Response of the scan (status, plus reason when rejected)
+        source: Where the scan was decided: 'api', 'batch' or 'gate:<id>'
+        event_id: Fixed _id for events that may be written more than once
+    """
+    ts = ts or datetime.utcnow()
+    event = {
+        "code_id": code_id,
+        "ts": ts,
+        "bucket": hour_bucket(ts),
+        "result": result.get("status"),
+        "reason": result.get("reason"),
+        "qr_number": result.get("qr_number"),
+        "device_id": device_id,
+        "source": source
+    }
+    if event_id is not None:
+        event["_id"] = event_id
+    return event
+
+class ScanEventLog:
+    """
+    Append-only writer for the scan_events collection
+
+    ``record`` and ``queue`` are write-behind: events are written by a
+    daemon thread within SCAN_EVENT_FLUSH_SECONDS, retried while MongoDB is
+    unreachable, and flushed once more at exit. ``record_many`` writes
+    synchronously for callers that must know the events are stored.
+    """
+
+    def __init__(self, collection, on_record=None):
+        self.collection = collection
+        # Called with the list of events once they are written
+        self.on_record = on_record
+        self.dropped = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def record(self, event):
+        """Queue one event; see ``queue``"""
+        self.queue([event])
+
+    def queue(self, events):
+        """
+        Queue events for the background writer
+
+        Never blocks on or fails because of MongoDB; the ticket counters the
+        events describe are already authoritative. Each event gets its _id
+        here, so a flush retried after a lost acknowledgement skips the
+        events already written.
+        """
+        if not events:
+            return
+        for event in events:
+            event.setdefault("_id", ObjectId())
+        with self._lock:
+            room = SCAN_EVENT_QUEUE_MAX - len(self._pending)
+            if len(events) > room:
+                self.dropped += len(events) - max(room, 0)
+                logger.warning("Scan event queue full, %d events dropped", self.dropped)
+                events = events[:max(room, 0)]
+            self._pending.extend(events)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_forever, name="scan-events", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            if len(self._pending) >= SCAN_EVENT_BATCH:
+                self._wakeup.set()
+
+    @property
+    def pending(self):
+        """Number of queued events not written yet"""
+        return len(self._pending)
+
+    def flush(self):
+        """
+        Write the queued events, one record_many per SCAN_EVENT_BATCH
+
+        Returns:
+            int: Number of events written
+        """
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._pending[:SCAN_EVENT_BATCH]
+                if not batch:
+                    return written
+                self.record_many(batch)
+                with self._lock:
+                    # Only flush removes events, so the batch is still in front
+                    del self._pending[:len(batch)]
+                written += len(batch)
+
+    def _flush_forever(self):
+        backoff = SCAN_EVENT_FLUSH_SECONDS
+        while True:
+            self._wakeup.wait(backoff)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                backoff = SCAN_EVENT_FLUSH_SECONDS
+            except PyMongoError as e:
+                # Offline: events stay queued, retry with backoff
+                backoff = min(max(backoff, 1) * 2, 30)
+                logger.warning("Could not write %d scan events: %s", self.pending, e)
+            except Exception:
+                logger.exception("Scan event writer error")
+
+    def record_many(self, events):
+        """
+        Append events with one unordered insert_many
+
+        Events with a fixed _id that were written before (a retried sync) are
+        skipped as duplicates; any other write error is raised.
+        """
+        if not events:
+            return
+        try:
+            self.collection.insert_many(events, ordered=False)
+        except BulkWriteError as e:
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY_ERROR]
+            if errors or e.details.get("writeConcernErrors"):
+                raise
+            # Duplicates were published when they were first written
+            duplicates = {error["index"] for error in e.details.get("writeErrors", [])}
+            events = [event for index, event in enumerate(events) if index not in duplicates]
+        self._notify(events)
+
+    def _notify(self, events):
+        if self.on_record and events:
+            try:
+                self.on_record(events)
+            except Exception:
+                logger.exception("Scan event listener failed")
+
+    def history(self, code_id, limit=100):
+        """Get the latest events of one ticket, newest first"""
+        return list(self.collection.find(
+            {"code_id": code_id},
+            {"_id": 0, "bucket": 0}
+        ).sort("ts", -1).limit(limit))
+
+def migrate_scan_history(codes_collection, event_log, batch_size=500):
+    """
+    Move legacy scan_history arrays off the ticket documents into scan_events
+
+    Each ticket's timestamps become 'valid' events with the same time, then
+    the array is removed. Event _ids are derived from the ticket and position,
+    so the migration can be re-run after an interruption.
+
+    Returns:
+        dict: Number of tickets and events migrated
+    """
+    tickets = 0
+    events = 0
+    updates = []
+    cursor = codes_collection.find(
+        {"scan_history": {"$exists": True}},
+        {"_id": 1, "code_id": 1, "qr_number": 1, "scan_history": 1}
+    )
+    for doc in cursor:
+        history = [ts for ts in doc.get("scan_history") or [] if isinstance(ts, datetime)]
+        event_log.record_many([
+            scan_event(
+                doc["code_id"],
+                {"status": "valid", "qr_number": doc.get("qr_number")},
+                ts,
+                source="migrated",
+                event_id=f"{doc['_id']}:{position}"
+            )
+            for position, ts in enumerate(history)
+        ])
+        updates.append(UpdateOne({"_id": doc["_id"]}, {"$unset": {"scan_history": ""}}))
+        tickets += 1
+        events += len(history)
+        if len(updates) >= batch_size:
+            codes_collection.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        codes_collection.bulk_write(updates, ordered=False)
+    return {"tickets": tickets, "events": events}
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Real-Time Scan Feed for Wedding Guest Verification System
+
+Pushes every scan (accepted or rejected) and every initialization to the
+door dashboard as Server-Sent Events, so the dashboard never has to poll.
+
+Each worker follows one MongoDB change stream over ``scan_events`` inserts
+and ``qr_codes`` updates that set a name, and fans the changes out to all of
+its connected clients from a ring buffer. Event ids are change stream resume
+tokens: a client reconnecting with ``Last-Event-ID`` is served from the
+buffer, or from a change stream resumed at its token when it has been away
+longer than the buffer reaches.
+
+On a standalone MongoDB (no change streams) the feed falls back to events
+published by this worker itself. Those ids only resume within the same
+process; otherwise the client gets a ``reset`` event and reloads once.
+"""
+
+import os
+import json
+import uuid
+import time
+import logging
+import threading
+from itertools import count
+from collections import deque
+from datetime import datetime
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Recent events kept per worker for clients that reconnect
+SCAN_STREAM_BUFFER = int(os.environ.get('SCAN_STREAM_BUFFER', 1000))
+
+# Seconds between keep-alive comments on an idle stream
+SCAN_STREAM_KEEPALIVE = float(os.environ.get('SCAN_STREAM_KEEPALIVE', 15))
+
+# Milliseconds the client waits before reconnecting
+SCAN_STREAM_RETRY_MS = 3000
+
+# Change stream error codes meaning the deployment has no change streams
+# (standalone server) rather than a passing failure
+CHANGE_STREAMS_UNSUPPORTED = {40573, 40324}
+
+# Scans and initializations, without full document lookups for updates
+CHANGE_PIPELINE = [
+    {"$match": {"$or": [
+        {"ns.coll": "scan_events", "operationType": "insert"},
+        {
+            "ns.coll": "qr_codes",
+            "operationType": "update",
+            "updateDescription.updatedFields.name": {"$type": "string"}
+        }
+    ]}}
+]
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def format_sse(event):
+    """Encode an event (or None for a keep-alive) in text/event-stream format"""
+    if event is None:
+        return ": keep-alive\n\n"
+    lines = []
+    if event.get("id"):
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event['data'], default=_json_default)}")
+    return "\n".join(lines) + "\n\n"
+
+def scan_data(doc):
+    """Client payload of a scan event document"""
+    return {
+        "code_id": doc.get("code_id"),
+        "qr_number": doc.get("qr_number"),
+        "result": doc.get("result"),
+        "reason": doc.get("reason"),
+        "device_id": doc.get("device_id"),
+        "source": doc.get("source"),
+        "ts": doc.get("ts")
+    }
+
+class EventBuffer:
+    """Ring buffer of recent events that subscribers block on"""
+
+    def __init__(self, size=None):
+        self._events = deque(maxlen=size or SCAN_STREAM_BUFFER)
+        self._seq = 0
+        self._condition = threading.Condition()
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def publish(self, event):
+        with self._condition:
+            self._seq += 1
+            self._events.append((self._seq, event))
+            self._condition.notify_all()
+
+    def position_of(self, event_id):
+        """Sequence number of a buffered event, None when it is not (or no longer) here"""
+        with self._condition:
+            for seq, event in reversed(self._events):
+                if event["id"] == event_id:
+                    return seq
+        return None
+
+    def wait(self, after_seq, timeout):
+        """Events after ``after_seq``, waiting up to ``timeout`` seconds for one"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._seq > after_seq, timeout)
+            return [(seq, event) for seq, event in self._events if seq > after_seq]
+
+class ScanFeed:
+    """Follows scans and initializations and serves them to stream subscribers"""
+
+    def __init__(self, db, codes_collection, buffer_size=None):
+        self.db = db
+        self.codes_collection = codes_collection
+        self.buffer = EventBuffer(buffer_size)
+        # 'change_stream' or 'local' once the follower thread has started
+        self.mode = None
+        self._resume_token = None
+        self._process_id = uuid.uuid4().hex[:8]
+        self._local_ids = count(1)
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start following the change stream on a daemon thread, once per process"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._follow, name="scan-feed", daemon=True).start()
+
+    def publish_scans(self, events):
+        """Publish scan events recorded by this worker (local mode only)"""
+        if self.mode == 'local':
+            for doc in events:
+                self._publish_local("scan", scan_data(doc))
+
+    def publish_init(self, code_id, name, qr_number=None, initialized_at=None):
+        """Publish an initialization made by this worker (local mode only)"""
+        if self.mode == 'local':
+            self._publish_local("init", {
+                "code_id": code_id,
+                "qr_number": qr_number,
+                "name": name,
+                "initialized_at": initialized_at or datetime.utcnow()
+            })
+
+    def subscribe(self, last_event_id=None):
+        """
+        Yield events for one client, resuming after ``last_event_id``
+
+        Yields None whenever SCAN_STREAM_KEEPALIVE seconds pass without an
+        event, so the caller can keep the connection alive.
+        """
+        after = self.buffer.last_seq
+        caught_up = set()
+        if last_event_id:
+            seq = self.buffer.position_of(last_event_id)
+            if seq is not None:
+                after = seq
+            elif self.mode == 'change_stream' and not last_event_id.startswith("local-"):
+                try:
+                    seq = yield from self._catch_up(last_event_id, caught_up)
+                    if seq is not None:
+                        after = seq
+                except PyMongoError as e:
+                    logger.info("Could not resume scan feed at %s: %s", last_event_id, e)
+                    yield self._reset_event("Resume point is no longer available")
+            else:
+                yield self._reset_event("Resume point is no longer available")
+
+        while True:
+            events = self.buffer.wait(after, SCAN_STREAM_KEEPALIVE)
+            if not events:
+                yield None
+            for seq, event in events:
+                after = seq
+                if event["id"] in caught_up:
+                    caught_up.discard(event["id"])
+                    continue
+                yield event
+
+    def iter_sse(self, last_event_id=None):
+        """Server-Sent Events text for one client"""
+        yield f"retry: {SCAN_STREAM_RETRY_MS}\n\n"
+        for event in self.subscribe(last_event_id):
+            yield format_sse(event)
+
+    def _catch_up(self, token, caught_up):
+        """
+        Replay changes after ``token`` from a change stream of its own
+
+        Stops as soon as a change is also in the buffer and returns the
+        sequence number to continue after; changes replayed past the buffer's end are recorded
+        in ``caught_up`` so the live loop does not send them twice.
+        """
+        with self.db.watch(CHANGE_PIPELINE, resume_after={"_data": token}, max_await_time_ms=500) as stream:
+            while True:
+                change = stream.try_next()
+                if change is None:
+                    return None
+                event = self._change_event(change)
+                if event is None:
+                    continue
+                seq = self.buffer.position_of(event["id"])
+                if seq is not None:
+                    # Continue from the buffer, this event included
+                    return seq - 1
+                caught_up.add(event["id"])
+                yield event
+
+    def _follow(self):
+        backoff = 1
+        while True:
+            try:
+                with self.db.watch(CHANGE_PIPELINE, resume_after=self._resume_token) as stream:
+                    self.mode = 'change_stream'
+                    backoff = 1
+                    for change in stream:
+                        self._resume_token = stream.resume_token
+                        event = self._change_event(change)
+                        if event is not None:
+                            self.buffer.publish(event)
+            except (OperationFailure, NotImplementedError) as e:
+                if isinstance(e, NotImplementedError) or e.code in CHANGE_STREAMS_UNSUPPORTED:
+                    logger.info("Change streams unavailable, scan feed uses this worker's events only")
+                    self.mode = 'local'
+                    return
+                logger.warning("Scan feed change stream failed: %s", e)
+            except PyMongoError as e:
+                logger.warning("Scan feed change stream failed: %s", e)
+            except Exception:
+                logger.exception("Scan feed stopped")
+                self.mode = 'local'
+                return
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _change_event(self, change):
+        event_id = change["_id"]["_data"]
+        if change["ns"]["coll"] == "scan_events":
+            return {"id": event_id, "type": "scan", "data": scan_data(change["fullDocument"])}
+
+        fields = change["updateDescription"]["updatedFields"]
+        code = self.codes_collection.find_one(
+            {"_id": change["documentKey"]["_id"]},
+            {"_id": 0, "code_id": 1, "qr_number": 1}
+        ) or {}
+        return {
+            "id": event_id,
+            "type": "init",
+            "data": {
+                "code_id": code.get("code_id"),
+                "qr_number": code.get("qr_number"),
+                "name": fields["name"],
+                "initialized_at": fields.get("initialized_at")
+            }
+        }
+
+    def _publish_local(self, event_type, data):
+        # Ids carry the process so a client reconnecting to another worker is reset
+        self.buffer.publish({
+            "id": f"local-{self._process_id}-{next(self._local_ids)}",
+            "type": event_type,
+            "data": data
+        })
+
+    def _reset_event(self, reason):
+        return {"id": None, "type": "reset", "data": {"reason": reason}}
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Streaming ZIP Export for Wedding Guest Verification System
+
+This module builds ZIP archives of QR images and invitation PDFs as a stream
+of chunks. Entries are stored rather than compressed (PNG and PDF data is
+already compressed) and each chunk is handed out as soon as an entry has been
+written, so an archive is never held in memory as a whole.
+"""
+
+import os
+import json
+import time
+import base64
+import zipfile
+from pathlib import Path
+from qr_renderer import build_qr_url
+from db_indexes import INITIALIZED_FILTER
+
+# Bytes read from an invitation PDF per chunk
+ZIP_READ_CHUNK = 64 * 1024
+
+# Codes read from MongoDB and rendered per batch
+ZIP_EXPORT_BATCH = int(os.environ.get('ZIP_EXPORT_BATCH', 200))
+
+class _ChunkSink:
+    """Write-only file object that collects what zipfile writes until drained"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Yield everything written since the last drain as one chunk, if anything"""
+        if self._chunks:
+            data = b"".join(self._chunks)
+            self._chunks = []
+            yield data
+
+def _zip_info(name, compress_type=zipfile.ZIP_STORED):
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = compress_type
+    info.external_attr = 0o644 << 16
+    return info
+
+def iter_zip(entries):
+    """
+    Write entries into a ZIP archive and yield it chunk by chunk
+
+    Args:
+        entries: Iterable of (name, content); content is bytes, or a Path whose
+            file is copied in ZIP_READ_CHUNK pieces. JSON and other text
+            entries (names ending in .json/.svg) are deflated, the rest stored.
+
+    Yields:
+        bytes: The next part of the archive
+    """
+    sink = _ChunkSink()
+    # The sink cannot seek, so zipfile writes a data descriptor after each entry
+    with zipfile.ZipFile(sink, mode='w', allowZip64=True) as archive:
+        for name, content in entries:
+            compress_type = zipfile.ZIP_DEFLATED if name.endswith(('.json', '.svg')) else zipfile.ZIP_STORED
+            info = _zip_info(name, compress_type)
+            if isinstance(content, Path):
+                info.file_size = content.stat().st_size
+                with open(content, 'rb') as source, archive.open(info, 'w') as target:
+                    while True:
+                        data = source.read(ZIP_READ_CHUNK)
+                        if not data:
+                            break
+                        target.write(data)
+                        yield from sink.drain()
+            else:
+                archive.writestr(info, content)
+            yield from sink.drain()
+    # Central directory
+    yield from sink.drain()
+
+def export_query(qr_from=None, qr_to=None, initialized_only=False):
+    """Build the MongoDB filter for an export"""
+    query = {}
+    if qr_from is not None or qr_to is not None:
+        query["qr_number"] = {}
+        if qr_from is not None:
+            query["qr_number"]["$gte"] = qr_from
+        if qr_to is not None:
+            query["qr_number"]["$lte"] = qr_to
+    if initialized_only:
+        # Same filter as the partial index on names, so it can be used
+        query.update(INITIALIZED_FILTER)
+    return query
+
+def iter_batches(cursor, size=None):
+    """Group a cursor into lists of ``size`` documents"""
+    size = size or ZIP_EXPORT_BATCH
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def iter_qr_image_entries(cursor, render_engine, base_url, image_format='png'):
+    """
+    Yield ZIP entries with a QR image per code, plus a manifest at the end
+
+    The next batch is submitted to the render engine before the current one is
+    written, so rendering overlaps with sending.
+    """
+    manifest = []
+    pending = None
+    for batch in iter_batches(cursor):
+        qr_urls = [build_qr_url(base_url, code["code_id"]) for code in batch]
+        submitted = (batch, qr_urls, render_engine.submit(qr_urls, image_format))
+        if pending:
+            yield from _image_entries(pending, image_format, manifest)
+        pending = submitted
+    if pending:
+        yield from _image_entries(pending, image_format, manifest)
+
+    yield "codes_metadata.json", _manifest_json(manifest)
+
+def _image_entries(pending, image_format, manifest):
+    batch, qr_urls, render = pending
+    for code, qr_url, image in zip(batch, qr_urls, render.result()):
+        # Same file names as qr_generator.py saves
+        filename = f"qr_{code['qr_number']:03d}_{code['code_id'][:8]}.{image_format}"
+        manifest.append({"code_id": code["code_id"], "qr_number": code["qr_number"], "qr_url": qr_url, "file": filename})
+        yield filename, image.encode() if image_format == 'svg' else base64.b64decode(image)
+
+def iter_invitation_entries(cursor, pdf_generator, render_missing=True, pdf_dir="qr_pdfs"):
+    """
+    Yield ZIP entries with the invitation PDF of each code, plus a manifest
+
+    PDFs already in ``pdf_dir`` are copied from disk; missing ones are rendered
+    in memory when ``render_missing`` is set, otherwise listed as missing.
+    """
+    manifest = []
+    for code in cursor:
+        code_id = code["code_id"]
+        qr_number = code.get("qr_number")
+        filename = code.get("pdf_filename") or f"invitation_qr_{qr_number or 'custom'}_{code_id[:8]}.pdf"
+        path = Path(pdf_dir) / filename
+        record = {"code_id": code_id, "qr_number": qr_number, "file": filename}
+
+        if path.is_file():
+            manifest.append(record)
+            yield filename, path
+        elif render_missing:
+            result = pdf_generator.embed_qr_in_pdf(code_id, qr_number, output_mode='bytes')
+            if result["success"]:
+                manifest.append(record)
+                yield filename, result["pdf_bytes"]
+            else:
+                manifest.append(dict(record, file=None, error=result["error"]))
+        else:
+            manifest.append(dict(record, file=None, error="PDF not generated"))
+
+    yield "invitations_metadata.json", _manifest_json(manifest)
+
+def _manifest_json(manifest):
+    return json.dumps({"total": len(manifest), "codes": manifest}, indent=2).encode()